@@ -1,9 +1,11 @@
 import streamlit as st
+import pandas as pd
 
-from helpers import sci_setup
+from helpers import sci_expiry, sci_setup, sci_trace
 
 sci_setup.setup_page("SciSpace LIMS")
 sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets["gcp_service_account"])
+sci_setup.connect_storage(st.secrets.get('storage'))
 
     
 # PAGES = {
@@ -29,7 +31,29 @@ def main():
     # """,
     # unsafe_allow_html=True)
 
-    pass
+    reagent_expiry_panel()
+
+
+def reagent_expiry_panel():
+    st.subheader('Reagent expiry')
+
+    index = st.session_state['db'].derived('inventory_reagents', 'expiry', sci_expiry.ExpiryIndex.from_records)
+    days = st.number_input('Expiring within (days)', min_value=1, max_value=365, value=sci_expiry.DEFAULT_DAYS)
+    expired = index.expired()
+    expiring = index.expiring_within(days)
+
+    col_expired, col_expiring = st.columns(2)
+    col_expired.metric('Expired', len(expired))
+    col_expiring.metric(f'Expiring within {days} days', len(expiring))
+
+    columns = ['expiration_date', 'id', 'name']
+    if expiring:
+        st.dataframe(pd.DataFrame(expiring, columns=columns), use_container_width=True)
+    if expired:
+        with st.expander('Expired reagents'):
+            # Most recently expired first
+            st.dataframe(pd.DataFrame(expired[::-1], columns=columns), use_container_width=True)
 
 if __name__ == '__main__':
     main()
+    sci_trace.finish_rerun()
@@ -0,0 +1,289 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.bench_sop_render import synthetic_sop
+from benchmarks.fake_gspread import FakeSpreadsheet
+from helpers import sci_report, sci_schema, sci_setup
+
+try:
+    from streamlit.testing.v1 import AppTest
+except ImportError:
+    # Streamlit < 1.28 has no AppTest, the pages are driven through LocalScriptRunner instead
+    AppTest = None
+
+INVENTORY_PAGE = 'pages/121_Inventory_Management.py'
+SOP_PAGE = 'pages/111_Standard_Operating_Procedures.py'
+INVENTORY_TABLE = 'inventory_reagents'
+
+# st.secrets of every session, main points audit_dir and custody_dir at a scratch directory
+SECRETS = {'gcp_service_account': {}}
+
+# Seconds a single rerun may take before the session is abandoned
+RERUN_TIMEOUT = 600
+
+# Bytecode of the pages, shared by every LocalScriptRunner, see _prepare_local_runner
+_script_cache = None
+
+
+def synthetic_inventory(table, n_rows):
+    """Rows for an inventory worksheet built from the schema examples, low cardinality columns repeat"""
+    fields = sci_schema.database_structures[table]
+    prefix = sci_schema.id_prefixes[table]
+    rows = [[field['column_name'] for field in fields]]
+    for i in range(n_rows):
+        row = []
+        for field in fields:
+            col = field['column_name']
+            example = field['example'] or col
+            if col == 'id':
+                row.append(f'{prefix}-{i:06x}')
+            elif field['type'] == 'date':
+                row.append((date(2023, 1, 1) + timedelta(days=i % 1000)).isoformat())
+            elif col in sci_schema.categorical_columns:
+                row.append(f'{example} {i % 20}')
+            else:
+                row.append(f'{example} {i}')
+        rows.append(row)
+    return rows
+
+
+def synthetic_sops(n_rows):
+    categories = list(sci_report.sop_categories.items())
+    record = synthetic_sop(20)
+    columns = ['id', 'category', 'number', 'version', 'effective_date'] + [col for col in record if col != 'id']
+    rows = [columns]
+    for i in range(n_rows):
+        category, code = categories[i % len(categories)]
+        values = {**record, 'id': f'{code}-{i:04d}-v01', 'category': category, 'number': i, 'version': 1,
+                  'effective_date': '2023-01-01', 'title': f'{record["title"]} {i}'}
+        rows.append([values[col] for col in columns])
+    return rows
+
+
+def spreadsheet(inventory_rows, sop_rows, **fake_options):
+    data = {table: synthetic_inventory(table, inventory_rows if table == INVENTORY_TABLE else 10)
+            for table in sci_schema.id_prefixes}
+    data['sops'] = synthetic_sops(sop_rows)
+    return FakeSpreadsheet(data, **fake_options)
+
+
+def use_spreadsheet(sh):
+    """Point the pages at the fake, the cached client and spreadsheet helpers are replaced for this process"""
+    sci_setup.google_sheets_client = lambda gcp_service_account: None
+    sci_setup.google_spreadsheet = lambda gc, sheet_name, sheet_key=None: sh
+
+
+def _prepare_local_runner():
+    """
+    LocalScriptRunner needs a Runtime for media files and st.cache_* storage
+    Each runner would compile the page itself, and compile() on several threads at once intermittently
+    fails with a SystemError on CPython 3.11, so the runners share one script cache that compiles under a lock
+    """
+    global _script_cache
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import secrets_singleton
+
+    config.set_option('runner.postScriptGC', False)
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    secrets_singleton._secrets = SECRETS
+    _script_cache = ScriptCache()
+
+
+class Session:
+    """One simulated user, each interaction is a full rerun of the page script"""
+
+    def __init__(self, page):
+        self.page = page
+        self.tree = None
+        self.app = None
+        self.session_state = None
+        self.failed = False
+
+    def _local_run(self, widget_states=None):
+        """
+        One rerun through LocalScriptRunner, reusing the session state directly
+        ElementTree.run() would deep copy it, which fails on the storage handles it holds
+        """
+        from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+        from streamlit.testing.local_script_runner import LocalScriptRunner
+
+        runner = LocalScriptRunner(self.page)
+        runner._script_cache = _script_cache
+        if self.session_state is not None:
+            runner.session_state = runner._session_state = self.session_state
+        tree = runner.run(widget_states, timeout=RERUN_TIMEOUT)
+        runner.join()
+        self.session_state = runner.session_state
+        for event, data in zip(runner.events, runner.event_data):
+            # The script never ran, so the tree is empty rather than holding an exception element
+            if event == ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR:
+                error = data.get('exception')
+                raise RuntimeError(f'{self.page} did not compile: {type(error).__name__}: {error}')
+        return tree
+
+    def _pin_selections(self):
+        """
+        LocalScriptRunner reports a selectbox or select_slider by looking up its raw value among the
+        options as displayed, which fails for non-string options and format_func, so those are pinned
+        to the displayed option, or the default one when the value cannot be mapped back
+        """
+        for widget in self.tree.get('selectbox') + self.tree.get('select_slider'):
+            if widget._value is None and widget.value not in widget.options:
+                if str(widget.value) in widget.options:
+                    widget.set_value(str(widget.value))
+                else:
+                    widget.set_value(widget.options[widget.proto.default if widget.type == 'selectbox' else widget.proto.default[0]])
+
+    def _run(self, widget=None):
+        """Rerun after interacting with widget, or the first run when widget is None"""
+        if AppTest is None and self.tree is not None:
+            self._pin_selections()
+        start = time.perf_counter()
+        if AppTest is not None:
+            self.tree = widget.run() if widget is not None else self.app.run()
+        else:
+            self.tree = self._local_run(self.tree.get_widget_states() if widget is not None else None)
+        elapsed = time.perf_counter() - start
+        exceptions = self.tree.get('exception')
+        if exceptions:
+            raise RuntimeError(f'{self.page} raised {exceptions[0].value}')
+        return elapsed
+
+    def _widget(self, kind, key=None, label=None):
+        """The widget the last rerun rendered, a LookupError naming it when the page did not render it"""
+        widget = next((widget for widget in self.tree.get(kind)
+                       if (key is None or widget.key == key) and (label is None or widget.label == label)), None)
+        if widget is None:
+            raise LookupError(f'{self.page} rendered no {kind} with key={key!r} label={label!r}')
+        return widget
+
+    def load(self):
+        if AppTest is not None:
+            self.app = AppTest.from_file(self.page, default_timeout=RERUN_TIMEOUT)
+            for key, value in SECRETS.items():
+                self.app.secrets[key] = value
+        return self._run()
+
+    def input(self, key, value):
+        return self._run(self._widget('text_input', key=key).input(value))
+
+    def click(self, key):
+        return self._run(self._widget('button', key=key).click())
+
+    def select(self, label, index):
+        return self._run(self._widget('selectbox', label=label).select_index(index))
+
+
+def inventory_actions(n_rows):
+    table = INVENTORY_TABLE
+    existing_id = f'{sci_schema.id_prefixes[table]}-{n_rows // 2:06x}'
+    return [
+        ('load', lambda s: s.load()),
+        ('search', lambda s: s.input(f'{table}_search', 'location:"Lab 1 3"')),
+        ('add', lambda s: s.click(f'{table}_add')),
+        # The data editor cannot be edited from a test, so the update rerun finds no changed cells
+        ('update', lambda s: s.input(f'{table}_update_id', existing_id) + s.click(f'{table}_update')),
+    ]
+
+
+def sop_actions(n_rows):
+    return [
+        ('load', lambda s: s.load()),
+        ('search', lambda s: s.input('sop_search', 'Revision')),
+        ('view', lambda s: s.select('SOP ID', min(1, n_rows - 1))),
+    ]
+
+
+def run_phases(sh, page, actions, n_sessions):
+    """
+    Run each action in all sessions at once, one phase per action
+    A session whose rerun fails, e.g. on a 429 the page did not handle, sits out the later phases
+    Returns {action: (rerun timings, API calls, 429 errors, failed sessions)}
+    """
+    sessions = [Session(page) for _ in range(n_sessions)]
+    results = {}
+    for name, action in actions:
+        timings, errors = [], []
+        sh.reset_calls()
+
+        def worker(session):
+            try:
+                timings.append(action(session))
+            except Exception as e:
+                session.failed = True
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        calls = dict(sh.calls)
+        results[name] = (timings, sum(n for method, n in calls.items() if method != '429'), calls.get('429', 0), errors)
+        sessions = [session for session in sessions if not session.failed]
+    return results
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the inventory and SOP pages against a fake spreadsheet')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[100, 1000, 10000, 100000], help='Rows in the inventory worksheet')
+    parser.add_argument('--sop-sizes', type=int, nargs='*', default=[10, 100, 1000], help='Rows in the sops worksheet')
+    parser.add_argument('--sessions', type=int, default=5, help='Concurrent sessions per phase')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds added to every fake API call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 429 on any API call')
+    parser.add_argument('--quota', type=int, default=None, help='API calls allowed per rolling minute before 429s')
+    parser.add_argument('--pages', nargs='*', default=['inventory', 'sops'], choices=['inventory', 'sops'])
+    args = parser.parse_args()
+
+    # The synthetic writes are audited and tracked like real ones, so their logs are kept out of the app's own
+    scratch = tempfile.TemporaryDirectory(prefix='scispace_bench_')
+    SECRETS.update(audit_dir=os.path.join(scratch.name, 'audit'), custody_dir=os.path.join(scratch.name, 'custody'))
+    if AppTest is None:
+        _prepare_local_runner()
+    fake_options = {'latency': args.latency, 'error_rate': args.error_rate, 'quota': args.quota}
+
+    runs = []
+    if 'inventory' in args.pages:
+        runs += [('inventory', INVENTORY_PAGE, size, 10, inventory_actions(size)) for size in args.sizes]
+    if 'sops' in args.pages:
+        runs += [('sops', SOP_PAGE, 10, size, sop_actions(size)) for size in args.sop_sizes]
+
+    print(f'{"page":<10} {"rows":>7} {"action":<8} {"p50 ms":>9} {"p95 ms":>9} {"API calls":>10} {"429s":>6} {"failed":>7}')
+    for page_name, page, inventory_rows, sop_rows, actions in runs:
+        sh = spreadsheet(inventory_rows, sop_rows, **fake_options)
+        use_spreadsheet(sh)
+        if AppTest is None:
+            # The runner resolves its script through a process wide pages cache keyed on the first script it ran
+            from streamlit import source_util
+            source_util.invalidate_pages_cache()
+        rows = inventory_rows if page_name == 'inventory' else sop_rows
+        for action, (timings, calls, quota_errors, errors) in run_phases(sh, page, actions, args.sessions).items():
+            p50, p95 = (statistics.median(timings) * 1000, percentile(timings, 0.95) * 1000) if timings else (float('nan'),) * 2
+            print(f'{page_name:<10} {rows:>7} {action:<8} {p50:>9.0f} {p95:>9.0f} {calls:>10} {quota_errors:>6} {len(errors):>7}')
+            for error in errors[:1]:
+                print(f'    {type(error).__name__}: {error}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import json
+import statistics
+import time
+
+from helpers import sci_report
+
+
+def synthetic_sop(n_steps):
+    """An SOP record as stored in the sheet, with n_steps procedure steps spread over sections"""
+    procedure = {f'{i + 1}. Section {i + 1}': [f'Step {j + 1} of section {i + 1}' for j in range(10)] for i in range(max(1, n_steps // 10))}
+    return {
+        'id': 'QU-0001-v01',
+        'title': 'Document Control Procedure',
+        'purpose': 'To ensure that all documents are controlled and that only current versions are available for use.',
+        'scope_covered': json.dumps([f'Covered item {i}' for i in range(5)]),
+        'scope_not_covered': json.dumps([f'Excluded item {i}' for i in range(5)]),
+        'applications': 'Quality Management System',
+        'definitions': json.dumps({f'Term {i}': f'Definition {i}' for i in range(10)}),
+        'responsibilities': json.dumps({f'Role {i}': f'Responsibility {i}' for i in range(5)}),
+        'procedure': json.dumps(procedure),
+        'ppe': json.dumps({'Gloves': 'Nitrile'}),
+        'hazards_and_mitigation': json.dumps({'Paper cuts': 'Handle with care'}),
+        'emergency_procedures': json.dumps({'Fire': 'Evacuate'}),
+        'related_documents': json.dumps({'QU-0002': 'Record Control'}),
+        'revision_history': json.dumps([
+            {'version': i + 1, 'effective_date': '2023-01-01', 'author': 'QA', 'description_of_changes': 'Revision'}
+            for i in range(max(1, n_steps // 20))
+        ]),
+    }
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure SOP render time against SOP size')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10, 100, 1000, 5000], help='Number of procedure steps')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"steps":>8} {"flowables ms":>14} {"pdf ms":>10} {"pdf kB":>8}')
+    for size in args.sizes:
+        record = synthetic_sop(size)
+        flowables = measure(lambda: sci_report.sop_report.flowables(record), args.repeat)
+        pdf = measure(lambda: sci_report.build_sop_pdf(record), args.repeat)
+        pdf_size = len(sci_report.build_sop_pdf(record)) / 1024
+        print(f'{size:>8} {flowables * 1000:>14.1f} {pdf * 1000:>10.1f} {pdf_size:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
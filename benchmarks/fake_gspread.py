@@ -0,0 +1,191 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from itertools import count
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, numericise_all
+
+_ids = count(1)
+
+
+def quota_error():
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({'error': {
+        'code': 429, 'status': 'RESOURCE_EXHAUSTED',
+        'message': "Quota exceeded for quota metric 'Read requests' and limit 'Read requests per minute per user'",
+    }}).encode()
+    return APIError(response)
+
+
+class FakeClient:
+    """Stand-in for the gspread Client, only the Drive metadata lookup is used"""
+
+    def __init__(self, sh):
+        self.sh = sh
+
+    def _get_file_drive_metadata(self, id):
+        self.sh.api_call('get_file_drive_metadata')
+        with self.sh._lock:
+            return {'id': id, 'name': self.sh.title, 'modifiedTime': self.sh.modified_time}
+
+
+class FakeSpreadsheet:
+    """
+    In-process stand-in for a gspread Spreadsheet holding its worksheets as lists of string rows
+    Every API method sleeps for latency seconds, counts the call in calls and raises a 429
+    APIError with probability error_rate, or once more than quota calls were made in the last minute
+    As in gspread 5.9, lastUpdateTime is the Drive modifiedTime read when the spreadsheet was opened,
+    writes only move modified_time, which client._get_file_drive_metadata returns
+    """
+
+    def __init__(self, data, latency=0.0, error_rate=0.0, quota=None, title='SciSpaceLIMS'):
+        self.id = f'fake-{next(_ids)}'
+        self.title = title
+        self.data = {name: [list(map(str, row)) for row in rows] for name, rows in data.items()}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.calls = Counter()
+        self.modified_time = '2023-01-01T00:00:00.000Z'
+        self._properties = {'id': self.id, 'name': title, 'modifiedTime': self.modified_time}
+        self.client = FakeClient(self)
+        self._lock = threading.RLock()
+        self._recent = []
+        self._worksheets = {name: FakeWorksheet(self, name, i) for i, name in enumerate(self.data)}
+
+    def api_call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            now = time.monotonic()
+            self._recent = [t for t in self._recent if now - t < 60] + [now]
+            over_quota = self.quota is not None and len(self._recent) > self.quota
+        if self.latency:
+            time.sleep(self.latency)
+        if over_quota or random.random() < self.error_rate:
+            self.calls['429'] += 1
+            raise quota_error()
+
+    @property
+    def lastUpdateTime(self):
+        return self._properties['modifiedTime']
+
+    def touch(self):
+        self.modified_time = f'{time.time():.6f}'
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def worksheet(self, title):
+        self.api_call('fetch_sheet_metadata')
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.api_call('batch_update')
+        with self._lock:
+            self.data[title] = []
+            self._worksheets[title] = FakeWorksheet(self, title, len(self._worksheets), cols)
+            self.touch()
+            return self._worksheets[title]
+
+    def worksheets(self):
+        self.api_call('fetch_sheet_metadata')
+        return list(self._worksheets.values())
+
+    def values_get(self, range_name):
+        self.api_call('values_get')
+        with self._lock:
+            return {'values': [list(row) for row in self.data[range_name.strip("'")]]}
+
+    def values_batch_get(self, ranges):
+        self.api_call('values_batch_get')
+        with self._lock:
+            return {'valueRanges': [{'values': [list(row) for row in self.data[name.strip("'").replace("''", "'")]]}
+                                    for name in ranges]}
+
+    def batch_update(self, body):
+        self.api_call('batch_update')
+        with self._lock:
+            for request in body['requests']:
+                target = request['deleteDimension']['range']
+                worksheet = next(ws for ws in self._worksheets.values() if ws.id == target['sheetId'])
+                del self.data[worksheet.title][target['startIndex']:target['endIndex']]
+            self.touch()
+
+
+class FakeWorksheet:
+
+    def __init__(self, sh, title, sheet_id, col_count=None):
+        self.sh = sh
+        self.title = title
+        self.id = sheet_id
+        self.col_count = col_count if col_count is not None else max((len(row) for row in self.rows), default=0)
+
+    @property
+    def rows(self):
+        return self.sh.data[self.title]
+
+    def get_all_values(self):
+        self.sh.api_call('get_all_values')
+        with self.sh._lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        self.sh.api_call('get_all_records')
+        with self.sh._lock:
+            header, rows = self.rows[0], self.rows[1:]
+            return [dict(zip(header, numericise_all((row + [''] * len(header))[:len(header)]))) for row in rows]
+
+    def col_values(self, col):
+        self.sh.api_call('col_values')
+        with self.sh._lock:
+            return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+
+    def row_values(self, row):
+        self.sh.api_call('row_values')
+        with self.sh._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self.sh.api_call('append_rows')
+        with self.sh._lock:
+            self.rows.extend([str(value) for value in row] for row in values)
+            self.sh.touch()
+
+    def batch_update(self, data, **kwargs):
+        self.sh.api_call('values_batch_update')
+        with self.sh._lock:
+            for update in data:
+                row, col = a1_to_rowcol(update['range'])
+                cells = self.rows[row - 1]
+                cells.extend([''] * (col - len(cells)))
+                cells[col - 1] = str(update['values'][0][0])
+            self.sh.touch()
+
+    def add_cols(self, cols):
+        self.sh.api_call('batch_update')
+        with self.sh._lock:
+            self.col_count += cols
+            self.sh.touch()
+
+    def delete_rows(self, start_index, end_index=None):
+        self.sh.api_call('delete_rows')
+        with self.sh._lock:
+            del self.rows[start_index - 1:end_index or start_index]
+            self.sh.touch()
+
+    def clear(self):
+        self.sh.api_call('clear')
+        with self.sh._lock:
+            del self.rows[:]
+            self.sh.touch()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+
+from helpers import sci_custody, sci_sheets
+
+# A checkpoint is written after every CHECKPOINT_INTERVAL entries
+CHECKPOINT_INTERVAL = 1000
+
+# prev hash of the first entry
+GENESIS = '0' * 64
+
+# revert records a local write on the replica backend overwritten by a newer remote edit
+ACTIONS = ['insert', 'update', 'delete', 'revert']
+
+# User of the entries written by the replica sync rather than by someone using the app
+SYNC_USER = 'sync'
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def entry_hash(entry):
+    """sha256 of an entry without its hash field, it includes prev so each entry commits to the one before"""
+    return hashlib.sha256(_canonical({k: v for k, v in entry.items() if k != 'hash'}).encode('utf-8')).hexdigest()
+
+
+class AuditLog:
+    """
+    Append-only, hash chained log of writes
+
+    Entries are JSON lines in audit.jsonl, each one holding the hash of the entry before it, so editing,
+    removing or reordering any entry breaks every hash after it. Every CHECKPOINT_INTERVAL entries the
+    sequence number, time, byte offset and hash are appended to checkpoints.jsonl. Verifying a date range
+    starts at the checkpoint before it and runs to the checkpoint after it, rather than from the first entry.
+    The head hash can be recorded elsewhere, e.g. in an inspection report, to detect a rewritten tail later.
+    """
+
+    def __init__(self, root, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.root = root
+        self.checkpoint_interval = checkpoint_interval
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, 'audit.jsonl')
+        self.checkpoints_path = os.path.join(root, 'checkpoints.jsonl')
+        self._lock = threading.Lock()
+        self._checkpoints = []
+        if os.path.exists(self.checkpoints_path):
+            with open(self.checkpoints_path, 'rb') as f:
+                self._checkpoints = [json.loads(line) for line in f if line.endswith(b'\n')]
+        self._checkpoint_times = [checkpoint['time'] for checkpoint in self._checkpoints]
+        self._repair()
+        start = self._checkpoints[-1] if self._checkpoints else None
+        self._seq, self._hash, self._time = (start['seq'], start['hash'], start['time']) if start else (0, GENESIS, '')
+        for _, entry in self._scan(start['offset'] if start else 0):
+            if entry is not None:
+                self._seq, self._hash, self._time = entry['seq'], entry['hash'], entry['time']
+
+    def _repair(self):
+        """Drop a last line cut short by a crash"""
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        with open(self.path, 'rb+') as f:
+            f.seek(max(0, os.path.getsize(self.path) - 1))
+            if f.read(1) not in (b'', b'\n'):
+                f.seek(0)
+                data = f.read()
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _scan(self, offset=0):
+        """Yield (offset after the line, entry) from offset on, entry is None for a line that is not one"""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if line.endswith(b'\n'):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # An edited line, or an offset that no longer starts a line
+                        entry = None
+                    yield offset, entry if isinstance(entry, dict) else None
+
+    def head(self):
+        """Sequence number and hash of the latest entry"""
+        with self._lock:
+            return {'seq': self._seq, 'hash': self._hash, 'time': self._time}
+
+    def append(self, user, action, table, item_id, before=None, after=None, time=None):
+        return self.append_many([(user, action, table, item_id, before, after)], time)[0]
+
+    def append_many(self, writes, time=None):
+        """
+        Record (user, action, table, item id, before, after) tuples with one fsync, returns the stored entries
+        before and after are the whole record, None for the side of an insert or delete that has no record
+        """
+        timestamp = sci_custody.to_timestamp(time)
+        with self._lock:
+            timestamp = max(timestamp, self._time)
+            entries, checkpoints, lines = [], [], []
+            seq, prev = self._seq, self._hash
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                for user, action, table, item_id, before, after in writes:
+                    if action not in ACTIONS:
+                        raise ValueError(f'Unknown audit action {action}, expected one of {", ".join(ACTIONS)}')
+                    seq += 1
+                    # Round trip through JSON so the hash is computed on exactly what is stored
+                    entry = json.loads(json.dumps({'seq': seq, 'time': timestamp, 'user': user, 'action': action,
+                                                   'table': table, 'id': item_id, 'before': before, 'after': after,
+                                                   'prev': prev}, default=str))
+                    entry['hash'] = prev = entry_hash(entry)
+                    line = _canonical(entry).encode('utf-8') + b'\n'
+                    offset += len(line)
+                    lines.append(line)
+                    entries.append(entry)
+                    if seq % self.checkpoint_interval == 0:
+                        checkpoints.append({'seq': seq, 'time': timestamp, 'offset': offset, 'hash': prev})
+                f.write(b''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            if checkpoints:
+                with open(self.checkpoints_path, 'ab') as f:
+                    f.write(b''.join(_canonical(checkpoint).encode('utf-8') + b'\n' for checkpoint in checkpoints))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._checkpoints += checkpoints
+                self._checkpoint_times += [checkpoint['time'] for checkpoint in checkpoints]
+            self._seq, self._hash, self._time = seq, prev, timestamp
+            return entries
+
+    def _start(self, start):
+        """The last checkpoint before start, or the beginning of the log"""
+        position = bisect_left(self._checkpoint_times, start) if start else 0
+        if position == 0:
+            return {'seq': 0, 'time': '', 'offset': 0, 'hash': GENESIS}
+        return self._checkpoints[position - 1]
+
+    def entries(self, start=None, end=None, table=None, item_id=None):
+        """Entries with start <= time <= end, optionally only those for one table and/or record"""
+        start = sci_custody.to_timestamp(start) if start is not None else None
+        end = sci_custody.to_timestamp(end) if end is not None else None
+        with self._lock:
+            offset = self._start(start)['offset']
+        found = []
+        for _, entry in self._scan(offset):
+            if entry is None:
+                continue
+            if end is not None and entry['time'] > end:
+                break
+            if ((start is None or entry['time'] >= start) and (table is None or entry['table'] == table)
+                    and (item_id is None or str(entry['id']) == str(item_id))):
+                found.append(entry)
+        return found
+
+    def verify(self, start=None, end=None):
+        """
+        Check the hash chain of the entries from start to end
+        Runs from the checkpoint before start to the checkpoint after end, or the head when there is none,
+        and checks every checkpoint passed on the way
+        Returns {'ok', 'checked', 'first_seq', 'last_seq', 'error'}
+        """
+        start = sci_custody.to_timestamp(start) if start is not None else None
+        end = sci_custody.to_timestamp(end) if end is not None else None
+        with self._lock:
+            begin = self._start(start)
+            head = {'seq': self._seq, 'hash': self._hash}
+            stop = bisect_right(self._checkpoint_times, end) if end else len(self._checkpoints)
+            # Checkpoints to compare against, and the one the check ends at
+            checkpoints = {checkpoint['seq']: checkpoint['hash'] for checkpoint in self._checkpoints[:stop + 1]
+                           if checkpoint['seq'] > begin['seq']}
+            last = self._checkpoints[stop] if stop < len(self._checkpoints) else head
+        result = {'ok': True, 'checked': 0, 'first_seq': begin['seq'] + 1, 'last_seq': begin['seq'], 'error': None}
+
+        def fail(seq, error):
+            result.update(ok=False, error=f'Entry {seq}: {error}')
+            return result
+
+        seq, prev = begin['seq'], begin['hash']
+        for _, entry in self._scan(begin['offset']):
+            if entry is None:
+                return fail(seq + 1, 'is not a valid entry, the log was edited')
+            if entry.get('seq') != seq + 1:
+                return fail(seq + 1, f'found entry {entry.get("seq")} in its place, entries were removed or reordered')
+            seq += 1
+            if entry.get('prev') != prev:
+                return fail(seq, 'does not follow the entry before it')
+            if entry_hash(entry) != entry.get('hash'):
+                return fail(seq, 'content does not match its hash')
+            if seq in checkpoints and checkpoints[seq] != entry['hash']:
+                return fail(seq, 'hash does not match its checkpoint')
+            prev = entry['hash']
+            result['checked'] += 1
+            result['last_seq'] = seq
+            if seq >= last['seq']:
+                break
+        if seq < last['seq']:
+            return fail(seq + 1, f'missing, the log ends before entry {last["seq"]}')
+        if last is head and prev != head['hash']:
+            return fail(seq, 'does not match the head of the log')
+        return result
+
+
+def record_conflict(log, conflict):
+    """
+    Log a replica write that lost to a remote edit as a revert, from the row as the write left it
+    to the remote row now, so the trail matches the spreadsheet until the local write is kept again
+    """
+    remote = conflict['remote']
+    before = None if conflict['op'] == 'delete' else {**(remote or {}), **conflict['record']}
+    log.append(SYNC_USER, 'revert', conflict['table'], conflict['id'], before, remote)
+
+
+class AuditedStorage:
+    """
+    Storage that records every insert, update and delete in an AuditLog as user
+    Each write is logged once storage has accepted it, a write that raises is not logged, and
+    inserts by insert_many are logged chunk by chunk as storage reports them written
+    Reads and anything else go straight to the wrapped storage
+    """
+
+    def __init__(self, storage, log, user=''):
+        self.storage = storage
+        self.log = log
+        self.user = user
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def insert(self, table, record):
+        self.storage.insert(table, record)
+        self.log.append(self.user, 'insert', table, record.get('id'), after=record)
+
+    def insert_many(self, table, records, progress=None):
+        records = list(records)
+        logged = 0
+
+        def log_chunk(done, total):
+            # Storage reports progress after each chunk, the first done records are written
+            nonlocal logged
+            self.log.append_many([(self.user, 'insert', table, record.get('id'), None, record)
+                                  for record in records[logged:done]])
+            logged = done
+            if progress:
+                progress(done, total)
+
+        self.storage.insert_many(table, records, log_chunk)
+
+    def update(self, table, item_id, changes, before=None):
+        recorded = before if before is not None else self.storage.get(table, item_id)
+        updated = self.storage.update(table, item_id, changes, before)
+        after = {**(recorded or {}), **changes}
+        # Writes that leave every value as it was are not recorded
+        if updated and any(not sci_sheets.same_value((recorded or {}).get(col), value) for col, value in changes.items()):
+            self.log.append(self.user, 'update', table, item_id, recorded, after)
+        return updated
+
+    def delete(self, table, item_id, before=None):
+        recorded = before if before is not None else self.storage.get(table, item_id)
+        deleted = self.storage.delete(table, item_id, before)
+        if deleted:
+            self.log.append(self.user, 'delete', table, item_id, before=recorded)
+        return deleted
+
+    def resolve_conflict(self, conflict, keep_local):
+        """Settle a replica conflict, keeping the local write logs it again as this user"""
+        resolved = self.storage.resolve_conflict(conflict, keep_local)
+        if resolved and keep_local:
+            remote = conflict['remote']
+            if conflict['op'] == 'delete':
+                self.log.append(self.user, 'delete', conflict['table'], conflict['id'], before=remote)
+            else:
+                self.log.append(self.user, 'update', conflict['table'], conflict['id'], remote,
+                                {**remote, **conflict['record']})
+        return resolved
@@ -0,0 +1,223 @@
+import threading
+import time
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+
+from helpers import sci_schema, sci_sheets, sci_trace
+
+# Seconds a fetched worksheet stays fresh before the next read goes back to Google Sheets
+DEFAULT_TTL = 60
+
+# Module level state is shared by every session served by this process
+_lock = threading.Lock()
+_worksheets = {}
+_entries = {}
+_headers = {}
+_generations = {}
+_prefetching = set()
+
+
+def _key(sh, worksheet_name):
+    return (sh.id, worksheet_name)
+
+
+def get_worksheet(sh, worksheet_name):
+    """
+    Return the worksheet handle, avoiding a metadata call on every rerun
+    A table in database_structures that the spreadsheet does not have yet is added with its header row
+    """
+    key = _key(sh, worksheet_name)
+    with _lock:
+        worksheet = _worksheets.get(key)
+    if worksheet is None:
+        try:
+            worksheet = sh.worksheet(worksheet_name)
+        except WorksheetNotFound:
+            columns = sci_schema.column_names(worksheet_name)
+            if not columns:
+                raise
+            worksheet = sh.add_worksheet(worksheet_name, rows=1, cols=len(columns))
+            worksheet.append_row(columns)
+        with _lock:
+            _worksheets[key] = worksheet
+    return worksheet
+
+
+def get_all_records(sh, worksheet_name, ttl=DEFAULT_TTL):
+    """
+    Read-through cache for worksheet.get_all_records()
+    The returned list is shared between sessions and must not be modified
+    """
+    key = _key(sh, worksheet_name)
+    with _lock:
+        entry = _entries.get(key)
+        generation = _generations.get(key, 0)
+    if entry is not None and time.monotonic() - entry['fetched'] < ttl:
+        return entry['records']
+
+    fetched = time.monotonic()
+    with sci_trace.span('sheets.read', worksheet=worksheet_name) as s:
+        records = get_worksheet(sh, worksheet_name).get_all_records()
+        s.size = len(records)
+
+    with _lock:
+        # Drop the result if a write invalidated the sheet while we were fetching
+        if _generations.get(key, 0) == generation:
+            _entries[key] = {'fetched': fetched, 'records': records, 'derived': {}}
+    return records
+
+
+def get_header(sh, worksheet_name, ttl=DEFAULT_TTL):
+    """
+    Column names of a worksheet, taken from the cached records when they are fresh,
+    otherwise read from the header row alone so a write never needs the whole sheet
+    """
+    key = _key(sh, worksheet_name)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        header = _headers.get(key)
+    if entry is not None and entry['records'] and now - entry['fetched'] < ttl:
+        return list(entry['records'][0].keys())
+    if header is not None and now - header['fetched'] < ttl:
+        return header['columns']
+
+    with sci_trace.span('sheets.header', worksheet=worksheet_name):
+        columns = get_worksheet(sh, worksheet_name).row_values(1)
+    with _lock:
+        _headers[key] = {'fetched': now, 'columns': columns}
+    return columns
+
+
+def missing_columns(header, records, table):
+    """Schema columns of table that some record has a value for but the header lacks, e.g. position on an older sheet"""
+    return [col for col in sci_schema.column_names(table) if col not in header
+            and any(sci_sheets.to_cell(record.get(col)) not in ('', None) for record in records)]
+
+
+def add_columns(sh, worksheet_name, columns):
+    """
+    Append columns to the header row of a worksheet, only called by a write that has values for them
+    Returns the header with the columns added
+    """
+    worksheet = get_worksheet(sh, worksheet_name)
+    header = worksheet.row_values(1)
+    missing = [col for col in columns if col not in header]
+    if missing:
+        width = len(header) + len(missing)
+        if worksheet.col_count < width:
+            sci_sheets.with_backoff(worksheet.add_cols, width - worksheet.col_count)
+        sci_sheets.with_backoff(worksheet.batch_update, [{'range': rowcol_to_a1(1, len(header) + i + 1), 'values': [[col]]}
+                                                         for i, col in enumerate(missing)])
+        header = header + missing
+    invalidate(sh, worksheet_name)
+    with _lock:
+        _headers[_key(sh, worksheet_name)] = {'fetched': time.monotonic(), 'columns': header}
+    return header
+
+
+def get_many(sh, worksheet_names, ttl=DEFAULT_TTL):
+    """
+    Records for several worksheets, every stale one is fetched in a single values_batch_get
+    Turns one metadata call plus one read per worksheet into a single request
+    """
+    now = time.monotonic()
+    result = {}
+    generations = {}
+    with _lock:
+        for worksheet_name in worksheet_names:
+            entry = _entries.get(_key(sh, worksheet_name))
+            if entry is not None and now - entry['fetched'] < ttl:
+                result[worksheet_name] = entry['records']
+            else:
+                generations[worksheet_name] = _generations.get(_key(sh, worksheet_name), 0)
+    if not generations:
+        return result
+
+    fetched = time.monotonic()
+    with sci_trace.span('sheets.batch_read', worksheets=len(generations)) as s:
+        values = sci_sheets.batch_get_values(sh, list(generations))
+        s.size = sum(len(rows) for rows in values.values())
+
+    with _lock:
+        for worksheet_name, generation in generations.items():
+            records = sci_sheets.records_from_values(values[worksheet_name])
+            result[worksheet_name] = records
+            key = _key(sh, worksheet_name)
+            if _generations.get(key, 0) == generation:
+                _entries[key] = {'fetched': fetched, 'records': records, 'derived': {}}
+    return result
+
+
+def get_frames(sh, worksheet_names, ttl=DEFAULT_TTL):
+    """DataFrames typed by database_structures, fetched together and converted once per version"""
+    get_many(sh, worksheet_names, ttl)
+    return {
+        worksheet_name: get_derived(sh, worksheet_name, 'frame', lambda records, table=worksheet_name: sci_schema.to_frame(records, table), ttl)
+        for worksheet_name in worksheet_names
+    }
+
+
+def get_derived(sh, worksheet_name, name, build, ttl=DEFAULT_TTL):
+    """
+    Return build(records), computed once per fetched version of the worksheet
+    Use for DataFrames, search indexes and anything else derived from the records
+    """
+    records = get_all_records(sh, worksheet_name, ttl)
+    key = _key(sh, worksheet_name)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry['records'] is records and name in entry['derived']:
+            return entry['derived'][name]
+
+    value = build(records)
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry['records'] is records:
+            value = entry['derived'].setdefault(name, value)
+    return value
+
+
+def invalidate(sh, worksheet_name=None):
+    """Forget cached records for one worksheet, or for the whole spreadsheet"""
+    with _lock:
+        if worksheet_name is None:
+            keys = [key for key in set(_entries) | set(_worksheets) if key[0] == sh.id]
+        else:
+            keys = [_key(sh, worksheet_name)]
+        for key in keys:
+            _entries.pop(key, None)
+            if worksheet_name is None:
+                # Row writes leave the header as it was
+                _headers.pop(key, None)
+            _generations[key] = _generations.get(key, 0) + 1
+
+
+def prefetch(sh, worksheet_names, ttl=DEFAULT_TTL):
+    """Warm the cache for worksheet_names on a background thread"""
+    now = time.monotonic()
+    with _lock:
+        keys = [
+            _key(sh, worksheet_name) for worksheet_name in worksheet_names
+            if _key(sh, worksheet_name) not in _prefetching
+            and now - _entries.get(_key(sh, worksheet_name), {}).get('fetched', -ttl) >= ttl
+        ]
+        _prefetching.update(keys)
+    if not keys:
+        return None
+
+    def _run():
+        try:
+            get_many(sh, [key[1] for key in keys], ttl)
+        except Exception:
+            # A failed prefetch is retried by the next foreground read
+            pass
+        finally:
+            with _lock:
+                _prefetching.difference_update(keys)
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,245 @@
+import glob
+import json
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+
+from helpers import sci_sheets
+
+EVENT_TYPES = ['check_out', 'check_in', 'transfer', 'location_change']
+
+# Events are partitioned into one segment file per month
+DEFAULT_PARTITION = '%Y-%m'
+
+# End of segment states kept in memory for location queries
+STATE_CACHE_SIZE = 4
+
+
+def to_timestamp(value=None):
+    """
+    UTC timestamp string that sorts in time order
+    value may be a datetime or ISO string, naive values are taken as UTC, None means now
+    """
+    if value is None:
+        value = datetime.now(timezone.utc)
+    elif isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class CustodyLog:
+    """
+    Append-only chain of custody events for samples
+
+    Events go to one JSON lines segment per time partition, e.g. events-2023-06.jsonl. Each event
+    carries the owner and location of the sample after it, so every segment is self describing.
+    Events are appended in time order, so once a newer segment exists a segment never changes and
+    two sidecar files are written for it the first time they are needed:
+        events-2023-06.idx.json    byte offsets of each sample's events in the segment
+        events-2023-06.state.json  the last event of every sample at the end of the segment
+
+    A sample's history reads only its own lines from the segments that mention it, and
+    "what was at location X at time T" loads one end of segment state and replays at most one segment.
+    """
+
+    def __init__(self, root, partition=DEFAULT_PARTITION):
+        self.root = root
+        self.partition = partition
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._offsets = {}
+        self._states = OrderedDict()
+        self._segments = sorted(os.path.basename(path)[len('events-'):-len('.jsonl')]
+                                for path in glob.glob(os.path.join(root, 'events-*.jsonl')))
+        if self._segments:
+            self._repair(self._segments[-1])
+        self._sample_segments = defaultdict(list)
+        for segment in self._segments:
+            for sample_id in self._segment_offsets(segment):
+                self._sample_segments[sample_id].append(segment)
+        self._last_time = self._last_event(self._segments[-1])['time'] if self._segments else ''
+
+    def _path(self, segment, suffix='.jsonl'):
+        return os.path.join(self.root, f'events-{segment}{suffix}')
+
+    def _segment_of(self, timestamp):
+        return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ').strftime(self.partition)
+
+    def _sealed(self, segment):
+        # Events are appended in time order, so only the newest segment can still grow
+        return segment != self._segments[-1]
+
+    def _scan(self, segment):
+        """Yield (offset, event) for every line of a segment"""
+        with open(self._path(segment), 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.endswith(b'\n'):
+                    # A line without a newline is a write cut short by a crash
+                    yield offset, json.loads(line)
+                offset += len(line)
+
+    def _repair(self, segment):
+        """Drop a last line cut short by a crash, so the next append starts on a line of its own"""
+        with open(self._path(segment), 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _save_sidecar(self, segment, suffix, value):
+        tmp_path = self._path(segment, suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(segment, suffix))
+
+    def _segment_offsets(self, segment):
+        """{sample id: [byte offsets]} for a segment, from its sidecar once the segment is sealed"""
+        offsets = self._offsets.get(segment)
+        if offsets is not None:
+            return offsets
+        if os.path.exists(self._path(segment, '.idx.json')):
+            with open(self._path(segment, '.idx.json')) as f:
+                offsets = json.load(f)
+        else:
+            offsets = defaultdict(list)
+            for offset, event in self._scan(segment):
+                offsets[event['sample_id']].append(offset)
+            offsets = dict(offsets)
+            if self._sealed(segment):
+                self._save_sidecar(segment, '.idx.json', offsets)
+        self._offsets[segment] = offsets
+        return offsets
+
+    def _read(self, segment, offsets):
+        events = []
+        with open(self._path(segment), 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                events.append(json.loads(f.readline()))
+        return events
+
+    def _last_event(self, segment):
+        last = None
+        for _, last in self._scan(segment):
+            pass
+        return last or {'time': ''}
+
+    def append(self, sample_id, event, location=None, owner=None, by='', notes='', time=None):
+        """
+        Record an event, owner and location default to the sample's current ones
+        Events must be appended in time order, returns the stored event
+        """
+        if event not in EVENT_TYPES:
+            raise ValueError(f'Unknown custody event {event}, expected one of {", ".join(EVENT_TYPES)}')
+        timestamp = to_timestamp(time)
+        with self._lock:
+            if timestamp < self._last_time:
+                raise ValueError(f'Custody events are append only, {timestamp} is before the last event at {self._last_time}')
+            current = self.current(sample_id) or {}
+            record = {
+                'time': timestamp,
+                'sample_id': sample_id,
+                'event': event,
+                'owner': current.get('owner', '') if owner is None else owner,
+                'location': current.get('location', '') if location is None else location,
+                'by': by,
+                'notes': notes,
+            }
+            segment = self._segment_of(timestamp)
+            if not self._segments or self._segments[-1] != segment:
+                self._segments.append(segment)
+                self._offsets[segment] = {}
+            with open(self._path(segment), 'ab') as f:
+                offset = f.tell()
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._segment_offsets(segment).setdefault(sample_id, []).append(offset)
+            if not self._sample_segments[sample_id] or self._sample_segments[sample_id][-1] != segment:
+                self._sample_segments[sample_id].append(segment)
+            self._last_time = timestamp
+            return record
+
+    def history(self, sample_id, start=None, end=None):
+        """Every event of a sample in time order, optionally limited to start <= time <= end"""
+        start = to_timestamp(start) if start is not None else None
+        end = to_timestamp(end) if end is not None else None
+        first = self._segment_of(start) if start else ''
+        last = self._segment_of(end) if end else '~'
+        with self._lock:
+            segments = [segment for segment in self._sample_segments.get(sample_id, []) if first <= segment <= last]
+            events = []
+            for segment in segments:
+                events += self._read(segment, self._segment_offsets(segment)[sample_id])
+        return [event for event in events if (start is None or event['time'] >= start) and (end is None or event['time'] <= end)]
+
+    def current(self, sample_id):
+        """The latest event of a sample, or None if it has no custody history"""
+        with self._lock:
+            segments = self._sample_segments.get(sample_id)
+            if not segments:
+                return None
+            return self._read(segments[-1], self._segment_offsets(segments[-1])[sample_id][-1:])[0]
+
+    def _end_state(self, segment):
+        """{sample id: last event} at the end of a sealed segment, chained from the segment before it"""
+        if segment in self._states:
+            self._states.move_to_end(segment)
+            return self._states[segment]
+        if os.path.exists(self._path(segment, '.state.json')):
+            with open(self._path(segment, '.state.json')) as f:
+                state = json.load(f)
+        else:
+            position = self._segments.index(segment)
+            state = dict(self._end_state(self._segments[position - 1])) if position else {}
+            for _, event in self._scan(segment):
+                state[event['sample_id']] = event
+            self._save_sidecar(segment, '.state.json', state)
+        self._states[segment] = state
+        while len(self._states) > STATE_CACHE_SIZE:
+            self._states.popitem(last=False)
+        return state
+
+    def snapshot(self, at=None):
+        """{sample id: last event at or before at}, the custody state of every sample at that time"""
+        timestamp = to_timestamp(at)
+        with self._lock:
+            position = bisect_right(self._segments, self._segment_of(timestamp))
+            if position == 0:
+                return {}
+            segment = self._segments[position - 1]
+            if segment != self._segment_of(timestamp) and self._sealed(segment):
+                # Every event of the segment is before the requested time
+                return dict(self._end_state(segment))
+            state = dict(self._end_state(self._segments[position - 2])) if position > 1 else {}
+            for _, event in self._scan(segment):
+                if event['time'] > timestamp:
+                    break
+                state[event['sample_id']] = event
+            return state
+
+    def at_location(self, location, at=None):
+        """
+        Samples whose location was location at time at, as their latest events
+        location is one location or a collection of them, e.g. a storage location and every one inside it
+        """
+        locations = {location} if isinstance(location, str) else {str(location) for location in location}
+        return sorted((event for event in self.snapshot(at).values() if str(event['location']) in locations),
+                      key=lambda event: event['sample_id'])
+
+
+def record_changes(log, sample_id, before, after, by=''):
+    """Append a transfer and/or location change for an edit of a sample's owner or location"""
+    owner = str(sci_sheets.to_cell(after.get('owner')))
+    location = str(sci_sheets.to_cell(after.get('location')))
+    previous_location = str(sci_sheets.to_cell(before.get('location')))
+    events = []
+    if owner != str(sci_sheets.to_cell(before.get('owner'))):
+        events.append(log.append(sample_id, 'transfer', owner=owner, location=previous_location, by=by))
+    if location != previous_location:
+        events.append(log.append(sample_id, 'location_change', owner=owner, location=location, by=by))
+    return events
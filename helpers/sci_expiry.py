@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+# Default look-ahead window for the dashboard and the digest job
+DEFAULT_DAYS = 30
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+class ExpiryIndex:
+    """
+    Reagents sorted by expiration date
+    Range queries are a bisect plus a slice, O(log n + k) for k matching reagents
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries)
+        self.dates = [entry[0] for entry in self.entries]
+
+    @classmethod
+    def from_records(cls, records, date_column='expiration_date'):
+        return cls(
+            (expires, record['id'], record.get('name', ''))
+            for record in records
+            if (expires := to_date(record.get(date_column))) is not None
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def between(self, start, end):
+        """Entries expiring on or after start and on or before end, as (date, id, name)"""
+        return self.entries[bisect_left(self.dates, start):bisect_right(self.dates, end)]
+
+    def expired(self, today=None):
+        today = today or date.today()
+        return self.entries[:bisect_left(self.dates, today)]
+
+    def expiring_within(self, days, today=None):
+        today = today or date.today()
+        return self.between(today, today + timedelta(days=days))
+
+
+def _load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        checkpoint['entries'] = [(to_date(d), i, n) for d, i, n in checkpoint['entries']]
+        return checkpoint
+    return {'modified': None, 'entries': None, 'reported_expiring': [], 'reported_expired': []}
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({**checkpoint, 'entries': [(d.isoformat(), i, n) for d, i, n in checkpoint['entries']]}, f)
+    os.replace(tmp_path, path)
+
+
+def run_digest(sh, checkpoint_path, digest_path, days=DEFAULT_DAYS, today=None):
+    """
+    Write a digest of reagents that expired or entered the expiry window since the last run
+    The reagents sheet is only read when the spreadsheet was modified after the checkpoint,
+    otherwise the index is restored from the checkpoint
+    """
+    today = today or date.today()
+    checkpoint = _load_checkpoint(checkpoint_path)
+
+    try:
+        modified = sh.lastUpdateTime
+    except Exception:
+        modified = None
+    if checkpoint['entries'] is None or modified is None or modified != checkpoint['modified']:
+        index = ExpiryIndex.from_records(sh.worksheet('inventory_reagents').get_all_records())
+    else:
+        index = ExpiryIndex(checkpoint['entries'])
+
+    expired = index.expired(today)
+    expiring = index.expiring_within(days, today)
+    reported_expired = set(checkpoint['reported_expired'])
+    reported_expiring = set(checkpoint['reported_expiring'])
+    new_expired = [entry for entry in expired if entry[1] not in reported_expired]
+    new_expiring = [entry for entry in expiring if entry[1] not in reported_expiring]
+
+    lines = [f'# Reagent expiry digest {today.isoformat()}', '',
+             f'{len(expired)} expired, {len(expiring)} expiring within {days} days', '']
+    if new_expired:
+        lines += ['## Newly expired', ''] + [f'- {d.isoformat()} {i} {n}' for d, i, n in new_expired] + ['']
+    if new_expiring:
+        lines += [f'## Expiring within {days} days', ''] + [f'- {d.isoformat()} {i} {n}' for d, i, n in new_expiring] + ['']
+    with open(digest_path, 'w') as f:
+        f.write('\n'.join(lines))
+
+    _save_checkpoint(checkpoint_path, {
+        'last_run': today.isoformat(),
+        'modified': modified,
+        'entries': index.entries,
+        # Reported ids are recomputed from the current index, so reagents removed from the sheet drop out
+        'reported_expired': [entry[1] for entry in expired],
+        'reported_expiring': [entry[1] for entry in expiring],
+    })
+    return new_expired, new_expiring
+
+
+def main():
+    import gspread
+
+    parser = argparse.ArgumentParser(description='Write a digest of expired and soon to expire reagents')
+    parser.add_argument('digest', help='Path of the markdown digest to write')
+    parser.add_argument('--credentials', required=True, help='Google service account JSON file')
+    parser.add_argument('--spreadsheet', default='SciSpaceLIMS')
+    parser.add_argument('--checkpoint', default='expiry_checkpoint.json')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    args = parser.parse_args()
+
+    sh = gspread.service_account(filename=args.credentials).open(args.spreadsheet)
+    new_expired, new_expiring = run_digest(sh, args.checkpoint, args.digest, args.days)
+    print(f'{len(new_expired)} newly expired, {len(new_expiring)} newly expiring, digest written to {args.digest}')
+
+
+if __name__ == '__main__':
+    main()
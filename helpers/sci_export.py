@@ -0,0 +1,113 @@
+import argparse
+import multiprocessing
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz
+import pandas as pd
+
+from helpers import sci_render, sci_report
+
+
+def current_sops(records, categories=None):
+    """Latest version of every SOP, optionally restricted to a list of category names"""
+    df = pd.DataFrame(records)
+    if df.empty:
+        return []
+    df = df[df['id'].astype(str) != '']
+    if categories is not None:
+        df = df[df['category'].isin(categories)]
+    df = df.assign(_version=pd.to_numeric(df['version'], errors='coerce'))
+    df = df.sort_values('_version').groupby(['category', 'number'], sort=False).tail(1)
+    return df.drop(columns='_version').sort_values('id').to_dict('records')
+
+
+def pdf_file_name(record):
+    return re.sub(r'[\\/:*?"<>|]', '_', f"{record['id']} - {record['title']}.pdf")
+
+
+def render_sop(record):
+    """Worker entry point, runs in a separate process"""
+    return sci_report.build_sop_pdf(record)
+
+
+def merge_pdfs(records, pdfs):
+    """Concatenate pdfs into one document with a bookmark per SOP, on the render thread like every fitz call"""
+    return sci_render.run(_merge_pdfs, records, pdfs)
+
+
+def _merge_pdfs(records, pdfs):
+    merged = fitz.open()
+    toc = []
+    for record, pdf_bytes in zip(records, pdfs):
+        toc.append([1, f"{record['id']} - {record['title']}", merged.page_count + 1])
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            merged.insert_pdf(pdf_document)
+    merged.set_toc(toc)
+    return merged.tobytes()
+
+
+def export_sops(records, fileobj, merged=False, max_workers=None, progress=None):
+    """
+    Render records in parallel across processes and stream the PDFs into a zip written to fileobj
+    With merged=True the zip holds a single bookmarked PDF instead, left out when no SOP rendered
+    SOPs that fail to render are listed in errors.txt and returned as {id: error}
+    """
+    errors = {}
+    pdfs = {}
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        # Spawned rather than forked, a fork of the threaded server can copy a lock another thread holds
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(render_sop, record): i for i, record in enumerate(records)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = records[futures[future]]
+                try:
+                    pdf_bytes = future.result()
+                except Exception as e:
+                    errors[record['id']] = repr(e)
+                else:
+                    if merged:
+                        pdfs[futures[future]] = pdf_bytes
+                    else:
+                        zf.writestr(pdf_file_name(record), pdf_bytes)
+                if progress:
+                    progress(done, len(records))
+
+        if merged and pdfs:
+            order = sorted(pdfs)
+            zf.writestr('SOPs.pdf', merge_pdfs([records[i] for i in order], [pdfs[i] for i in order]))
+        if errors:
+            zf.writestr('errors.txt', '\n'.join(f'{sop_id}: {error}' for sop_id, error in errors.items()))
+    return errors
+
+
+def main():
+    import gspread
+
+    parser = argparse.ArgumentParser(description='Export the current version of every SOP as PDFs in a zip file')
+    parser.add_argument('output', help='Path of the zip file to write')
+    parser.add_argument('--credentials', required=True, help='Google service account JSON file')
+    parser.add_argument('--spreadsheet', default='SciSpaceLIMS')
+    parser.add_argument('--category', nargs='*', choices=sci_report.sop_categories.values(), help='Category codes to export, all by default')
+    parser.add_argument('--merged', action='store_true', help='Write one bookmarked PDF instead of one PDF per SOP')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    categories = None
+    if args.category:
+        categories = [name for name, code in sci_report.sop_categories.items() if code in args.category]
+
+    sh = gspread.service_account(filename=args.credentials).open(args.spreadsheet)
+    records = current_sops(sh.worksheet('sops').get_all_records(), categories)
+
+    with open(args.output, 'wb') as f:
+        errors = export_sops(records, f, args.merged, args.workers,
+                             progress=lambda done, total: print(f'{done}/{total}', end='\r'))
+    print(f'Exported {len(records) - len(errors)} of {len(records)} SOPs to {args.output}')
+    for sop_id, error in errors.items():
+        print(f'{sop_id}: {error}')
+
+
+if __name__ == '__main__':
+    main()
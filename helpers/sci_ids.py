@@ -0,0 +1,66 @@
+import secrets
+import threading
+
+from helpers import sci_schema
+
+# Hex digits after the prefix, matching the existing ids such as RE-02c045
+ID_LENGTH = 6
+
+_lock = threading.Lock()
+
+# Ids handed out in this process that may not have reached the cached records yet
+_reserved = set()
+
+
+class IdIndex:
+    """
+    Hash index from id to row position, built once per version of a table
+    Membership and lookups are O(1) instead of a boolean mask over the whole frame
+    """
+
+    def __init__(self, records):
+        self.positions = {str(record.get('id')): position for position, record in enumerate(records)}
+
+    def __contains__(self, item_id):
+        return str(item_id) in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def position(self, item_id):
+        return self.positions.get(str(item_id))
+
+    def row(self, df, item_id):
+        """The row of df with item_id as a one row DataFrame, or an empty one if there is none"""
+        position = self.position(item_id)
+        if position is not None and position < len(df) and str(df['id'].iat[position]) == str(item_id):
+            return df.iloc[position:position + 1]
+        return df.iloc[0:0]
+
+
+def id_index(db, table):
+    return db.derived(table, 'ids', IdIndex)
+
+
+def new_id(prefix, taken):
+    """A random id with prefix that is neither in taken nor already handed out by this process"""
+    with _lock:
+        while True:
+            item_id = f'{prefix}-{secrets.token_hex(ID_LENGTH // 2)}'
+            if item_id not in taken and item_id not in _reserved:
+                _reserved.add(item_id)
+                return item_id
+
+
+def allocate(db, table, count=1):
+    """
+    Allocate count unused ids for table, checked against the id index of the stored records
+    Returns a single id when count is 1, otherwise a list
+    """
+    index = id_index(db, table)
+    prefix = sci_schema.id_prefixes[table]
+    with _lock:
+        # Reservations that have reached the stored records no longer need tracking
+        _reserved.difference_update([item_id for item_id in _reserved if item_id in index])
+    ids = [new_id(prefix, index) for _ in range(count)]
+    return ids[0] if count == 1 else ids
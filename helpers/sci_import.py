@@ -0,0 +1,141 @@
+import os
+
+import pandas as pd
+
+from helpers import sci_ids, sci_schema
+
+# Rows read, validated and written per chunk
+CHUNK_SIZE = 500
+
+
+class ImportFileError(ValueError):
+    """
+    The file could not be read as a table of items, e.g. a malformed CSV or an invalid XLSX
+    imported is the number of rows written from the chunks before the one that failed
+    """
+
+    def __init__(self, message, imported=0):
+        super().__init__(message)
+        self.imported = imported
+
+
+def read_chunks(file, file_name, chunk_size=CHUNK_SIZE):
+    """Yield the rows of a CSV or XLSX file as DataFrames of text, without loading the whole file"""
+    try:
+        if os.path.splitext(file_name)[1].lower() in ('.xlsx', '.xlsm'):
+            yield from _read_xlsx_chunks(file, chunk_size)
+        else:
+            yield from pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    except ImportError:
+        raise
+    except Exception as e:
+        # pandas ParserError, UnicodeDecodeError, openpyxl and zipfile errors for a file that is not an xlsx, ...
+        raise ImportFileError(f'{file_name} could not be read: {e}') from e
+
+
+def _read_xlsx_chunks(file, chunk_size):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError('Importing .xlsx files requires openpyxl, pip install openpyxl or upload a CSV')
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(col).strip() for col in next(rows, ())]
+        chunk = []
+        for row in rows:
+            chunk.append(['' if value is None else str(value) for value in row[:len(header)]])
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def validate_chunk(df, table, existing_ids):
+    """
+    Check every row of df against the required, unique and type flags in database_structures
+    Returns (valid_rows, errors) where errors has the offending row number and a message per problem
+    existing_ids is updated with the ids of the valid rows so later chunks see them
+    """
+    fields = sci_schema.fields_by_name(table)
+    df = df.rename(columns=lambda col: str(col).strip()).fillna('')
+    repeated = sorted(set(df.columns[df.columns.duplicated()]))
+    if repeated:
+        raise ImportFileError(f'The header repeats the column {", ".join(repeated)}')
+    problems = pd.Series('', index=df.index)
+
+    for col, field in fields.items():
+        if col not in df.columns:
+            if field['required'] and not field['primary_key']:
+                problems += f'missing column {col}; '
+            continue
+        values = df[col].astype(str).str.strip()
+        empty = values == ''
+        if field['required'] and not field['primary_key']:
+            problems[empty] += f'{col} is required; '
+        if field['type'] == 'int':
+            problems[~empty & pd.to_numeric(values, errors='coerce').isna()] += f'{col} must be a whole number; '
+        elif field['type'] == 'date':
+            problems[~empty & pd.to_datetime(values, format='%Y-%m-%d', errors='coerce').isna()] += f'{col} must be a YYYY-MM-DD date; '
+
+    if 'id' in df.columns:
+        ids = df['id'].astype(str).str.strip()
+        given = ids != ''
+        problems[given & ids.isin(existing_ids)] += 'id already exists; '
+        problems[given & ids.duplicated(keep=False)] += 'id is repeated in the file; '
+
+    invalid = problems != ''
+    errors = pd.DataFrame({'row': df.index[invalid] + 2, 'error': problems[invalid].str.rstrip('; ')})
+    errors = pd.concat([errors.reset_index(drop=True), df[invalid].reset_index(drop=True)], axis=1)
+
+    valid = df[~invalid][[col for col in df.columns if col in fields]]
+    if 'id' in valid.columns:
+        existing_ids.update(valid.loc[valid['id'] != '', 'id'])
+    return valid, errors
+
+
+def assign_ids(df, prefix, existing_ids):
+    """Fill empty ids in bulk with ids that are not in existing_ids"""
+    if 'id' not in df.columns:
+        df = df.assign(id='')
+    missing = df['id'].astype(str).str.strip() == ''
+    new_ids = [sci_ids.new_id(prefix, existing_ids) for _ in range(missing.sum())]
+    existing_ids.update(new_ids)
+    df.loc[missing, 'id'] = new_ids
+    return df
+
+
+def import_file(db, table, file, file_name, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Stream file into table chunk by chunk, writing each chunk of valid rows with one append
+    Returns (rows imported, DataFrame of rejected rows with their errors)
+    progress is called with (rows read, rows imported) after every chunk
+    Raises ImportFileError when the file cannot be read, the chunks before it stay imported
+    """
+    existing_ids = set(sci_ids.id_index(db, table).positions)
+    all_errors = []
+    rows_read = 0
+    imported = 0
+    try:
+        for chunk in read_chunks(file, file_name, chunk_size):
+            chunk.index = chunk.index - chunk.index[0] + rows_read if len(chunk) else chunk.index
+            rows_read += len(chunk)
+            valid, errors = validate_chunk(chunk, table, existing_ids)
+            if len(errors):
+                all_errors.append(errors)
+            if len(valid):
+                valid = assign_ids(valid.copy(), sci_schema.id_prefixes[table], existing_ids)
+                db.insert_many(table, valid.to_dict('records'))
+                imported += len(valid)
+            if progress:
+                progress(rows_read, imported)
+    except ImportFileError as e:
+        e.imported = imported
+        raise
+
+    errors = pd.concat(all_errors, ignore_index=True) if all_errors else pd.DataFrame(columns=['row', 'error'])
+    return imported, errors
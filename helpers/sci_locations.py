@@ -0,0 +1,242 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from helpers import sci_ids, sci_sheets
+
+LOCATIONS_TABLE = 'storage_locations'
+
+# From the outside in, a location may only sit inside one of a higher level
+LEVELS = ['building', 'room', 'freezer', 'rack', 'box']
+
+# Sorts after every character used in ids, closing the range of paths under a prefix
+_PATH_END = '\uffff'
+
+
+def _letters(n):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    n += 1
+    while n:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def position_label(slot, cols):
+    """Slot number in a box with cols columns to its label, row letter then column number, e.g. 0 -> A1"""
+    row, col = divmod(slot, cols)
+    return f'{_letters(row)}{col + 1}'
+
+
+def parse_position(label, rows, cols):
+    """Label such as B3 to its slot number, or None if it is not a position in a rows x cols box"""
+    label = str(label or '').strip().upper()
+    split = len(label) - len(label.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    if not split or not label[split:].isdigit():
+        return None
+    row = 0
+    for letter in label[:split]:
+        row = row * 26 + ord(letter) - ord('A') + 1
+    row, col = row - 1, int(label[split:]) - 1
+    if not (0 <= row < rows and 0 <= col < cols):
+        return None
+    return row * cols + col
+
+
+def _size(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class LocationTree:
+    """
+    Materialized path index over the storage_locations table, built once per version of the table
+
+    Each location only stores its parent_id, the path from the root is derived here, one name and id
+    per level, and kept sorted so every subtree is one contiguous range found by bisection, in the
+    order of the names. Moving a rack is therefore a single write of its parent_id, the items inside
+    refer to their box and never change.
+    """
+
+    def __init__(self, records):
+        self.nodes = {str(record.get('id')): record for record in records if str(record.get('id', '')) != ''}
+        self.paths = {}
+        self.labels = {}
+        for location_id in self.nodes:
+            self._path(location_id)
+        ordered = sorted((path, location_id) for location_id, path in self.paths.items())
+        self._keys = [path for path, _ in ordered]
+        self._ids = [location_id for _, location_id in ordered]
+
+    def _path(self, location_id):
+        # Walk up to the first ancestor with a known path, a missing parent or a cycle makes a root
+        chain = []
+        while location_id in self.nodes and location_id not in self.paths and location_id not in chain:
+            chain.append(location_id)
+            location_id = str(self.nodes[location_id].get('parent_id') or '')
+        path, label = self.paths.get(location_id, ''), self.labels.get(location_id)
+        for location_id in reversed(chain):
+            name = str(self.nodes[location_id].get('name'))
+            path = self.paths[location_id] = f'{path}{name}\x1f{location_id}/'
+            label = self.labels[location_id] = f'{label} / {name}' if label else name
+
+    def __contains__(self, location_id):
+        return str(location_id) in self.nodes
+
+    def level(self, location_id):
+        return self.nodes[str(location_id)].get('level')
+
+    def label(self, location_id):
+        """Names from the root down, e.g. Building A / Room 101 / Freezer 3"""
+        return self.labels.get(str(location_id), str(location_id))
+
+    def ordered(self):
+        """Every location id, each followed by the locations inside it"""
+        return list(self._ids)
+
+    def matching(self, term):
+        """Ids of the locations whose label contains term, which takes in everything inside them"""
+        term = str(term).lower()
+        return [location_id for location_id in self._ids if term in self.labels[location_id].lower()]
+
+    def subtree(self, location_id):
+        """location_id and every location below it"""
+        path = self.paths.get(str(location_id))
+        if path is None:
+            return []
+        return self._ids[bisect_left(self._keys, path):bisect_left(self._keys, path + _PATH_END)]
+
+    def boxes(self, location_id):
+        return [box_id for box_id in self.subtree(location_id) if self.level(box_id) == 'box']
+
+    def box_size(self, box_id):
+        node = self.nodes[str(box_id)]
+        return _size(node.get('rows')), _size(node.get('cols'))
+
+
+class LocationIndex:
+    """Items of an inventory table grouped by location id, and by slot within each location"""
+
+    def __init__(self, records):
+        self.items = defaultdict(list)
+        self.positions = defaultdict(dict)
+        for record in records:
+            location_id = str(record.get('location') or '')
+            if location_id:
+                self.items[location_id].append(record.get('id'))
+                if str(record.get('position') or ''):
+                    self.positions[location_id][str(record['position']).strip().upper()] = record.get('id')
+
+
+def location_tree(db):
+    return db.derived(LOCATIONS_TABLE, 'tree', LocationTree)
+
+
+def location_index(db, table):
+    return db.derived(table, 'locations', LocationIndex)
+
+
+def describe(tree, location):
+    """Label of a location id, any other value is free text from before storage locations and shown as it is"""
+    return tree.label(location) if location in tree else str(location or '-')
+
+
+def subtree_items(tree, index, location_id):
+    """Ids of the items at location_id or anywhere below it"""
+    return [item_id for sub_id in tree.subtree(location_id) for item_id in index.items.get(sub_id, [])]
+
+
+def occupancy(tree, index, box_id):
+    """{slot number: item id} of a box, positions outside the box are left out"""
+    rows, cols = tree.box_size(box_id)
+    slots = {}
+    for label, item_id in index.positions.get(str(box_id), {}).items():
+        slot = parse_position(label, rows, cols)
+        if slot is not None:
+            slots[slot] = item_id
+    return slots
+
+
+def _first_gap(occupied):
+    """Smallest slot number missing from a sorted list of distinct ones, by bisection on occupied[i] == i"""
+    lo, hi = 0, len(occupied)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if occupied[mid] == mid:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def free_slot(tree, index, location_id):
+    """(box id, position label) of the first free slot in the boxes at or below location_id, or None"""
+    for box_id in tree.boxes(location_id):
+        rows, cols = tree.box_size(box_id)
+        occupied = sorted(occupancy(tree, index, box_id))
+        if len(occupied) < rows * cols:
+            return box_id, position_label(_first_gap(occupied), cols)
+    return None
+
+
+def occupancy_grid(tree, index, box_id, names=None):
+    """The box as a DataFrame of row letters by column numbers, each cell the item there, names maps item ids to labels"""
+    rows, cols = tree.box_size(box_id)
+    grid = [[''] * cols for _ in range(rows)]
+    for slot, item_id in occupancy(tree, index, box_id).items():
+        grid[slot // cols][slot % cols] = (names or {}).get(item_id, item_id)
+    return pd.DataFrame(grid, index=[_letters(row) for row in range(rows)], columns=[str(col + 1) for col in range(cols)])
+
+
+def check_parent(tree, level, parent_id, location_id=None):
+    """Raise ValueError unless a location of level, or location_id itself, may be placed in parent_id"""
+    if not parent_id:
+        return
+    if parent_id not in tree:
+        raise ValueError(f'{parent_id} is not a storage location')
+    if location_id is not None and parent_id in tree.subtree(location_id):
+        raise ValueError(f'{tree.label(location_id)} cannot be moved inside itself')
+    parent_level = tree.level(parent_id)
+    if level in LEVELS and parent_level in LEVELS and LEVELS.index(level) <= LEVELS.index(parent_level):
+        raise ValueError(f'A {level} cannot be placed in a {parent_level}')
+
+
+def add_location(db, tree, name, level, parent_id='', rows=0, cols=0, notes=''):
+    """Insert a storage location, returns its id"""
+    check_parent(tree, level, parent_id)
+    location_id = sci_ids.allocate(db, LOCATIONS_TABLE)
+    db.insert(LOCATIONS_TABLE, {'id': location_id, 'parent_id': parent_id, 'name': name, 'level': level,
+                                'rows': rows if level == 'box' else '', 'cols': cols if level == 'box' else '', 'notes': notes})
+    return location_id
+
+
+def move_location(db, tree, location_id, parent_id):
+    """Move a location and everything in it under parent_id with one write"""
+    check_parent(tree, tree.level(location_id), parent_id, location_id)
+    node = tree.nodes[location_id]
+    return db.update(LOCATIONS_TABLE, location_id, {'parent_id': parent_id}, before=node)
+
+
+def legacy_locations(tree, records):
+    """{free text location: number of items}, for locations entered as text before storage locations were set up"""
+    counts = Counter(str(record.get('location') or '') for record in records)
+    return {location: n for location, n in sorted(counts.items()) if location and location not in tree}
+
+
+def assign_location(db, table, text, location_id):
+    """
+    Point every item whose location is the free text text at location_id
+    Returns (before, after) for each item moved, items changed by someone else meanwhile are left as they are
+    """
+    moved = []
+    for record in db.query(table, location=text):
+        try:
+            if db.update(table, record['id'], {'location': location_id}, before=record):
+                moved.append((record, {**record, 'location': location_id}))
+        except sci_sheets.ConflictError:
+            continue
+    return moved
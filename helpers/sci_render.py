@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import fitz
+
+from helpers import sci_trace
+
+# MuPDF is not thread safe, so every fitz call in the app goes through a single worker thread,
+# here or through run(). This keeps rasterization off the script thread while sessions share one queue
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sci_render')
+
+
+def content_key(record, template_version):
+    """Content address for a rendered record, changes whenever the record or template does"""
+    payload = json.dumps(record, sort_keys=True, default=str)
+    digest = hashlib.sha256(f'{template_version}\n{payload}'.encode('utf-8')).hexdigest()
+    record_id = re.sub(r'[^A-Za-z0-9_.-]', '_', str(record.get('id', 'record')))
+    return f'{record_id}-{digest[:16]}'
+
+
+class RenderCache:
+    """
+    Bytes cache with an in-memory LRU tier bounded by max_bytes and an optional on-disk tier
+    Keys must be safe to use as file names
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._size = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        if self.disk_dir and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                value = f.read()
+            self._remember(key, value)
+            return value
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.disk_dir:
+            # Write then rename so readers never see a partial file
+            tmp_path = f'{self._path(key)}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+
+    def get_or_create(self, key, create):
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def _remember(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def run(func, *args):
+    """Call func on the render thread and wait for its result, for fitz work outside this module"""
+    return _executor.submit(sci_trace.bind(func), *args).result()
+
+
+def cached_pdf(cache, key, build_pdf):
+    """Return the PDF bytes for key, only calling build_pdf on a cache miss"""
+    return cache.get_or_create(f'{key}.pdf', build_pdf)
+
+
+@sci_trace.traced('fitz.page_count')
+def _page_count(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return pdf_document.page_count
+
+
+@sci_trace.traced('fitz.rasterize', size=len)
+def _rasterize(pdf_bytes, page_number, dpi):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        pix = pdf_document[page_number - 1].get_pixmap(dpi=dpi)
+        return pix.tobytes("png")
+
+
+def page_count(cache, key, pdf_bytes):
+    count = cache.get_or_create(f'{key}.pages', lambda: str(_executor.submit(sci_trace.bind(_page_count), pdf_bytes).result()).encode())
+    return int(count)
+
+
+def submit_page(cache, key, pdf_bytes, page_number, dpi):
+    """
+    Rasterize one page on the worker thread, returning a Future of the PNG bytes
+    Cached pages resolve immediately without touching the worker
+    """
+    page_key = f'{key}-p{page_number}-{dpi}dpi.png'
+    png = cache.get(page_key)
+    if png is not None:
+        future = Future()
+        future.set_result(png)
+        return future
+
+    def _render():
+        png = _rasterize(pdf_bytes, page_number, dpi)
+        cache.put(page_key, png)
+        return png
+
+    return _executor.submit(sci_trace.bind(_render))
+
+
+def render_pages(cache, key, pdf_bytes, page_numbers, dpi):
+    """Rasterize several pages, e.g. thumbnails, returning their PNG bytes in order"""
+    futures = [submit_page(cache, key, pdf_bytes, page_number, dpi) for page_number in page_numbers]
+    return [future.result() for future in futures]
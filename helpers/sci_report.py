@@ -1,3 +1,8 @@
+import json
+from io import BytesIO
+
+import pandas as pd
+
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.styles import ParagraphStyle, ListStyle, getSampleStyleSheet
@@ -6,6 +11,18 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, PageTemplate
 from reportlab.platypus.flowables import HRFlowable, Spacer
 from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
 
+from helpers import sci_trace
+
+pdf_styles = getSampleStyleSheet()
+
+sop_categories = {
+    'Quality Assurance and Control': 'QU',
+    'Equipment': 'EQ',
+    'Analytical': 'AN',
+    'Procedure': 'PR',
+    'Safety': 'SA'
+}
+
 # Define custom styles for PDF generation
 pdf_title_style = ParagraphStyle(
     "title",
@@ -83,4 +100,133 @@ def dict2table(d):
         ('LINEBELOW',(0,0), (-1,0), 1, colors.black),
         ('BOX', (0,0), (-1,-1), 1, colors.black),
         ('ROWBACKGROUNDS', (0,0), (-1,-1), [colors.lightgrey, colors.white])],
-      hAlign = 'LEFT')
\ No newline at end of file
+      hAlign = 'LEFT')
+
+# Section schema for SOP documents
+# Each block is (kind, field) or (kind, field, style), heading blocks hold literal text instead of a field
+sop_template = [
+    {'title': None, 'blocks': [('text', 'id', 'Normal'), ('text', 'title', 'Heading1')]},
+    {'title': 'Purpose', 'blocks': [('text', 'purpose')]},
+    {'title': 'Scope', 'blocks': [
+        ('heading', 'Covered'), ('bullets', 'scope_covered'),
+        ('heading', 'Not covered'), ('bullets', 'scope_not_covered'),
+    ]},
+    {'title': 'Applications', 'blocks': [('text', 'applications')]},
+    {'title': 'Definitions', 'blocks': [('terms', 'definitions')]},
+    {'title': 'Responsibilities', 'blocks': [('terms', 'responsibilities')]},
+    {'title': 'Procedure', 'blocks': [('steps', 'procedure')]},
+    {'title': 'Health and Safety', 'blocks': [
+        ('heading', 'PPE'), ('terms', 'ppe'),
+        ('heading', 'Hazards and mitigation'), ('terms', 'hazards_and_mitigation'),
+        ('heading', 'Emergency procedures'), ('terms', 'emergency_procedures'),
+    ]},
+    {'title': 'Related Documents', 'blocks': [('terms', 'related_documents')]},
+    {'title': 'Revision History', 'blocks': [('table', 'revision_history')]},
+]
+
+# Bump whenever sop_template or the block renderers change so cached renders are not reused
+sop_template_version = 1
+
+
+def _text_block(field, style='Normal'):
+    style = pdf_styles[style]
+    return lambda record: [Paragraph(str(record[field]), style)]
+
+
+def _heading_block(text, style='Heading3'):
+    style = pdf_styles[style]
+    return lambda record: [Paragraph(text, style)]
+
+
+def _bullets_block(field, style='Normal'):
+    style = pdf_styles[style]
+    return lambda record: [Paragraph(f"• {x}", style) for x in record[field]]
+
+
+def _terms_block(field, style='Normal'):
+    style = pdf_styles[style]
+    return lambda record: [Paragraph(f"<b>{k}:</b> {v}", style) for k, v in record[field].items()]
+
+
+def _steps_block(field, style='Normal'):
+    heading_style = pdf_styles['Heading3']
+    style = pdf_styles[style]
+
+    def render(record):
+        elements = []
+        for k, v in record[field].items():
+            elements.append(Paragraph(k, heading_style))
+            elements += [Paragraph(f"• {x}", style) for x in v]
+        return elements
+    return render
+
+
+def _table_block(field):
+    def render(record):
+        table = pd.DataFrame(record[field])
+        table.columns = [" ".join(i.split("_")).capitalize() for i in table.columns]
+        return [df2table(table)]
+    return render
+
+
+_block_renderers = {
+    'text': _text_block,
+    'heading': _heading_block,
+    'bullets': _bullets_block,
+    'terms': _terms_block,
+    'steps': _steps_block,
+    'table': _table_block,
+}
+
+# Blocks whose field is stored in the sheet as JSON
+_json_blocks = {'bullets', 'terms', 'steps', 'table'}
+
+
+class ReportTemplate:
+    """
+    A section schema compiled once into block renderers
+    Any record can then be rendered to flowables or a PDF without Streamlit
+    """
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.json_fields = set()
+        self._renderers = []
+        for section in sections:
+            renderers = [_block_renderers[kind](*args) for kind, *args in section['blocks']]
+            if section['title']:
+                renderers.insert(0, _heading_block(section['title'], 'Heading2'))
+            self._renderers.append(renderers)
+            self.json_fields.update(args[0] for kind, *args in section['blocks'] if kind in _json_blocks)
+
+    def parse(self, record):
+        """Decode each JSON field of a sheet record once, values that are already decoded are kept"""
+        parsed = dict(record)
+        for field in self.json_fields:
+            if isinstance(parsed.get(field), str):
+                parsed[field] = json.loads(parsed[field])
+        return parsed
+
+    def flowables(self, record):
+        record = self.parse(record)
+        elements = []
+        for renderers in self._renderers:
+            for render in renderers:
+                elements += render(record)
+            elements += [Spacer(1, 10), HRFlowable(width="100%")]
+        return elements
+
+    def build_pdf(self, record):
+        with sci_trace.span('report.build') as s:
+            buffer = BytesIO()
+            doc = SimpleDocTemplate(buffer)
+            doc.build(self.flowables(record), canvasmaker=NumberedCanvas)
+            s.size = buffer.getbuffer().nbytes
+            return buffer.getbuffer().tobytes()
+
+
+sop_report = ReportTemplate(sop_template)
+
+
+def build_sop_pdf(record):
+    return sop_report.build_pdf(record)
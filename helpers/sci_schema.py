@@ -0,0 +1,139 @@
+import pandas as pd
+
+# database_structures = {
+#     "inventory_equipment": ['id', 'name', 'type', 'sub_type', 'manufacturer', 'model', 'serial_number', 'location', 'notes'],
+#     "inventory_reagents": ['id', 'name', 'supplier', 'catalog_number', 'lot_number', 'expiration_date', 'cas', 'location', 'notes'],
+#     "inventory_samples": ['id', 'name', 'type', 'description', 'owner', 'location', 'notes'],
+#     "inventory_supplies": ['id', 'name', 'description', 'supplier', 'catalog_number', 'location', 'notes'],
+#     "sops": ['id', 'category', 'number', 'version', 'title', 'effective_date', 'purpose', 'related_documents', 'scope', 'procedure', 'references'],
+#     }
+
+database_structures = {
+    "inventory_equipment": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the equipment", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "EQ-99414a"},
+        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "HPLC - Agilent 1260 Infinity II"},
+        {"column_name": "application", "formated_name": "Application", "type": "string", "description": "Application of the equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Analytical"},
+        {"column_name": "type", "formated_name": "Type", "type": "string", "description": "Type of equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Chromatography"},
+        {"column_name": "sub_type", "formated_name": "Sub Type", "type": "string", "description": "Sub type of equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "High Performance Liquid Chromatography (HPLC)"},
+        {"column_name": "manufacturer", "formated_name": "Manufacturer", "type": "string", "description": "Manufacturer of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Agilent"},
+        {"column_name": "model", "formated_name": "Model", "type": "string", "description": "Model of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "1260 Infinity II"},
+        {"column_name": "serial_number", "formated_name": "Serial Number", "type": "string", "description": "Serial number of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "US12345678"},
+        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "ID of the storage location holding the equipment, or text entered before storage locations were set up", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "LO-5c81e2"},
+        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Used for HPLC analysis"},       
+    ],
+    "inventory_reagents": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the reagent", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "RRE-02c045"},
+        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Acetonitrile"},
+        {"column_name": "supplier", "formated_name": "Supplier", "type": "string", "description": "Supplier of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Fisher Scientific"},
+        {"column_name": "catalog_number", "formated_name": "Catalog Number", "type": "string", "description": "Catalog number of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "A998-4"},
+        {"column_name": "lot_number", "formated_name": "Lot Number", "type": "string", "description": "Lot number of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "123456"},
+        {"column_name": "expiration_date", "formated_name": "Expiration Date", "type": "date", "description": "Expiration date of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "2021-12-31"},
+        {"column_name": "cas", "formated_name": "CAS", "type": "string", "description": "Chemical Abstracts Service (CAS) number of the reagent", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "75-05-8"},
+        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "ID of the storage location holding the reagent, or text entered before storage locations were set up", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "LO-5c81e2"},
+        {"column_name": "position", "formated_name": "Position", "type": "string", "description": "Position of the reagent in its box, row letter then column number", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "A1"},
+        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the reagent", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in flammable cabinet"},
+    ],
+    "inventory_samples": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the sample", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "SA-ad6b54"},
+        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the sample", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Sample 1"},
+        {"column_name": "type", "formated_name": "Type", "type": "string", "description": "Type of sample", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Chemical"},
+        {"column_name": "description", "formated_name": "Description", "type": "string", "description": "Description of the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Sample of chemical X"},
+        {"column_name": "owner", "formated_name": "Owner", "type": "string", "description": "Owner of the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "John Smith"},
+        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "ID of the storage location holding the sample, or text entered before storage locations were set up", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "LO-5c81e2"},
+        {"column_name": "position", "formated_name": "Position", "type": "string", "description": "Position of the sample in its box, row letter then column number", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "C4"},
+        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in freezer"},
+    ],
+    "inventory_supplies": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the supply", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "SU-30acb7"},
+        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Gloves, Nitrile, M"},
+        {"column_name": "category", "formated_name": "Category", "type": "string", "description": "Category of the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "PPE"},
+        {"column_name": "description", "formated_name": "Description", "type": "string", "description": "Description of the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Nitrile gloves, size medium"},
+        {"column_name": "supplier", "formated_name": "Supplier", "type": "string", "description": "Supplier of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Fisher Scientific"},
+        {"column_name": "catalog_number", "formated_name": "Catalog Number", "type": "string", "description": "Catalog number of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "11889610"},
+        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "ID of the storage location holding the supply, or text entered before storage locations were set up", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "LO-5c81e2"},
+        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in cabinet"},
+    ],
+    "storage_locations": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the storage location", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "LO-5c81e2"},
+        {"column_name": "parent_id", "formated_name": "Parent ID", "type": "string", "description": "Storage location this one is inside, empty for a building", "required": False, "unique": False, "primary_key": False, "foreign_key": True, "default": None, "example": "LO-0d3f97"},
+        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the storage location", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Freezer 3"},
+        {"column_name": "level", "formated_name": "Level", "type": "string", "description": "Building, room, freezer, rack or box", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "freezer"},
+        {"column_name": "rows", "formated_name": "Rows", "type": "int", "description": "Rows of positions in a box", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 9},
+        {"column_name": "cols", "formated_name": "Columns", "type": "int", "description": "Columns of positions in a box", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 9},
+        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the storage location", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "-80 C"},
+    ],
+    "sops": [
+        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the SOP", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "QA-0001-v01"},
+        {"column_name": "category", "formated_name": "Category", "type": "string", "description": "Category of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Quality Assurance"},
+        {"column_name": "number", "formated_name": "Number", "type": "int", "description": "Number of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 1},
+        {"column_name": "version", "formated_name": "Version", "type": "int", "description": "Version of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 1},
+        {"column_name": "title", "formated_name": "Title", "type": "string", "description": "Title of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Document Control Procedure"},
+        {"column_name": "effective_date", "formated_name": "Effective Date", "type": "date", "description": "Effective date of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "2021-01-01"},
+        {"column_name": "purpose", "formated_name": "Purpose", "type": "string", "description": "Purpose of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "To ensure that all documents are controlled and that only current versions are available for use."},
+        {"column_name": "scope_covered", "formated_name": "Scope Covered", "type": "string", "description": "JSON list of what the SOP covers", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '["All controlled documents of the QMS"]'},
+        {"column_name": "scope_not_covered", "formated_name": "Scope Not Covered", "type": "string", "description": "JSON list of what the SOP does not cover", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '["External standards"]'},
+        {"column_name": "applications", "formated_name": "Applications", "type": "string", "description": "Applications of the SOP", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 'Quality Management System'},
+        {"column_name": "definitions", "formated_name": "Definitions", "type": "string", "description": "JSON object of terms and their definitions", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{"QMS": "Quality Management System"}'},
+        {"column_name": "responsibilities", "formated_name": "Responsibilities", "type": "string", "description": "JSON object of roles and their responsibilities", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{"Document Controller": "Maintains the Document Control Register"}'},
+        {"column_name": "procedure", "formated_name": "Procedure", "type": "string", "description": "JSON object of section headings and their steps", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{"1. Document Creation": ["Draft the document in the standard format"]}'},
+        {"column_name": "ppe", "formated_name": "PPE", "type": "string", "description": "JSON object of personal protective equipment and when to use it", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{"Gloves": "Nitrile"}'},
+        {"column_name": "hazards_and_mitigation", "formated_name": "Hazards and Mitigation", "type": "string", "description": "JSON object of hazards and how they are mitigated", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{}'},
+        {"column_name": "emergency_procedures", "formated_name": "Emergency Procedures", "type": "string", "description": "JSON object of emergencies and what to do", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{}'},
+        {"column_name": "related_documents", "formated_name": "Related Documents", "type": "string", "description": "JSON object of related document ids and titles", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '{"QU-0002": "Record Control"}'},
+        {"column_name": "revision_history", "formated_name": "Revision History", "type": "string", "description": "JSON list of revisions, each with version, effective_date, author and description_of_changes", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": '[{"version": 1, "effective_date": "2021-01-01", "author": "QA", "description_of_changes": "First issue"}]'},
+    ],
+}
+
+
+def column_names(table):
+    return [field['column_name'] for field in database_structures.get(table, [])]
+
+
+def fields_by_name(table):
+    return {field['column_name']: field for field in database_structures.get(table, [])}
+
+
+# Low cardinality text columns stored as pandas categoricals
+categorical_columns = {'location', 'supplier', 'category', 'application', 'type', 'sub_type', 'manufacturer', 'owner'}
+
+# Prefix of the ids allocated for each table, e.g. RE-02c045
+id_prefixes = {
+    'inventory_reagents': 'RE',
+    'inventory_samples': 'SA',
+    'inventory_supplies': 'SU',
+    'inventory_equipment': 'EQ',
+    'storage_locations': 'LO',
+}
+
+
+def _typed_column(values, field):
+    column_type = field.get('type') if field else None
+    series = pd.Series(values, dtype=object)
+    if column_type == 'int':
+        series = pd.to_numeric(series, errors='coerce')
+        # Anything that is not a whole number becomes missing rather than forcing a float column
+        return series.where(series.mod(1) == 0).astype('Int64')
+    if column_type == 'date':
+        dates = pd.to_datetime(series, format='%Y-%m-%d', errors='coerce')
+        other_formats = dates.isna() & (series.astype(str) != '')
+        if other_formats.any():
+            dates[other_formats] = pd.to_datetime(series[other_formats], errors='coerce')
+        return dates
+    if field and field['column_name'] in categorical_columns:
+        return pd.Categorical(series.where(series != ''))
+    return series
+
+
+def to_frame(records, table):
+    """
+    Build a DataFrame from sheet records, each column created directly with the dtype of its schema type
+    int columns are nullable Int64, date columns datetime64 and low cardinality text columns categorical
+    """
+    fields = fields_by_name(table)
+    columns = list(records[0].keys()) if records else list(fields)
+    return pd.DataFrame({col: _typed_column([record.get(col) for record in records], fields.get(col)) for col in columns})
+
+
+def editable(df):
+    """Copy of df with categoricals as plain text, so st.data_editor accepts values that are not yet categories"""
+    return df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
@@ -0,0 +1,67 @@
+import shlex
+
+import numpy as np
+import pandas as pd
+
+from helpers import sci_trace
+
+SEARCH_HELP = 'All terms must match. Use "quotes" for phrases and column:term to search a single column, e.g. location:"freezer 2"'
+
+# Joins cells in the row text so a term cannot match across two columns
+_SEPARATOR = '\x1f'
+
+
+def parse_query(query, columns=()):
+    """
+    Split a query into (column, term) pairs
+    column is None for terms that should match anywhere in the row
+    """
+    try:
+        tokens = shlex.split(query)
+    except ValueError:
+        # Unbalanced quotes, fall back to plain whitespace splitting
+        tokens = query.split()
+
+    terms = []
+    for token in tokens:
+        column, sep, term = token.partition(':')
+        if sep and column.lower() in columns:
+            terms.append((column.lower(), term.lower()))
+        else:
+            terms.append((None, token.lower()))
+    return [(column, term) for column, term in terms if term]
+
+
+class SearchIndex:
+    """Lowercased text of a DataFrame, built once per data version and queried with vectorized string ops"""
+
+    def __init__(self, df):
+        self.index = df.index
+        # Empty cells of typed columns are NaN, NaT or <NA>, which must not be searchable as text
+        self.columns = {str(col).lower(): df[col].astype(object).where(df[col].notna(), '').astype(str).str.lower()
+                        for col in df.columns}
+
+        text = pd.Series('', index=df.index, dtype=object)
+        for values in self.columns.values():
+            text = text + _SEPARATOR + values
+        self.text = text
+
+    @sci_trace.traced('search', size=lambda mask: int(mask.sum()))
+    def mask(self, query, aliases=None):
+        """
+        aliases maps a column to a function returning the values that also match a term in it,
+        e.g. the ids of the storage locations whose names contain the term
+        """
+        mask = np.ones(len(self.index), dtype=bool)
+        for column, term in parse_query(query, self.columns):
+            values = self.text if column is None else self.columns[column]
+            matched = values.str.contains(term, regex=False).to_numpy(dtype=bool)
+            for alias_column, alias in (aliases or {}).items():
+                if column in (None, alias_column) and alias_column in self.columns:
+                    matched |= self.columns[alias_column].isin([str(value).lower() for value in alias(term)]).to_numpy(dtype=bool)
+            mask &= matched
+        return pd.Series(mask, index=self.index)
+
+    def search(self, df, query, aliases=None):
+        """Return the rows of df (the frame this index was built from) matching query"""
+        return df[self.mask(query, aliases)]
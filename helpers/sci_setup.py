@@ -1,18 +1,49 @@
+import functools
+import os
+import time
+
 import streamlit as st
-from PIL import Image
 import gspread
+from requests.adapters import HTTPAdapter
+
+from helpers import sci_audit, sci_cache, sci_custody, sci_schema, sci_storage, sci_sync, sci_trace
+
+# Served by [server] enableStaticServing at app/static/..., resolved from this file rather than the working directory
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+STATIC_URL = 'app/static'
 
-def logo():
-    return Image.open('./scispace.png')
+@st.cache_resource(show_spinner=False)
+def favicon_bytes():
+    # Raw bytes skip decoding and re-encoding the icon on every set_page_config
+    with open(os.path.join(STATIC_DIR, 'favicon.ico'), 'rb') as f:
+        return f.read()
 
-def fav():
-    return Image.open('./favicon.ico')
+# The logo is an <img> fetched from the static route, so the browser caches it instead of each rerun sending it
+page_setup = f"""
+    <img src="{STATIC_URL}/scispace.png" alt="SciSpace" style="width:100%">
+    <div>
+        <a href="https://www.buymeacoffee.com/ryanmellor" target="_blank">
+            <img src="https://cdn.buymeacoffee.com/buttons/default-black.png" alt="Buy Me A Coffee" height="41" width="174">
+        </a>
+    </div>
+    <hr/>
+    <style>
+        footer {{visibility: hidden;}}
+        [data-testid="stTickBar"] {{height:0; visibility:hidden;}}
+        thead tr th:first-child {{display:none}}
+        tbody th {{display:none}}
+        [data-testid="stFileUploadDropzone"] {{display:grid}}
+        [data-testid="stSidebarNav"] ul {{max-height:none}}
+    </style>
+"""
 
 def setup_page(page_title):
 
+    sci_trace.start_rerun(page_title)
+
     st.set_page_config(
         page_title=page_title,
-        page_icon=fav(),
+        page_icon=favicon_bytes(),
         layout="centered"
     )
 
@@ -20,24 +51,6 @@ def setup_page(page_title):
 
     st.set_option('deprecation.showPyplotGlobalUse', False)
 
-    st.sidebar.image(logo())
-
-    page_setup = """
-        <div>
-            <a href="https://www.buymeacoffee.com/ryanmellor" target="_blank">
-                <img src="https://cdn.buymeacoffee.com/buttons/default-black.png" alt="Buy Me A Coffee" height="41" width="174">
-            </a>
-        </div>
-        <hr/>
-        <style>
-            footer {visibility: hidden;}
-            [data-testid="stTickBar"] {height:0; visibility:hidden;}
-            thead tr th:first-child {display:none}
-            tbody th {display:none}
-            [data-testid="stFileUploadDropzone"] {display:grid}
-            [data-testid="stSidebarNav"] ul {max-height:none}
-        </style>
-    """
     st.sidebar.markdown(page_setup, unsafe_allow_html=True,)
 
 def plot_layout ():
@@ -52,9 +65,122 @@ def plot_layout ():
         # "uirevision": "foo",
     }
 
-def connect_google_sheets(sheet_name, gcp_service_account):
+@st.cache_resource
+def google_sheets_client(gcp_service_account):
+    """
+    One authorized client per process, shared by every session and script thread
+    The underlying requests session keeps connections alive and reuses the access token until it expires
+    """
+    gc = gspread.service_account_from_dict(gcp_service_account)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    gc.session.mount('https://', adapter)
+    gc.session.hooks['response'].append(sci_trace.record_response)
+    return gc
+
+@st.cache_resource
+def google_spreadsheet(_gc, sheet_name, sheet_key=None):
+    # Opening by name is a Drive search, so the handle is resolved once and reused by key
+    if sheet_key:
+        return _gc.open_by_key(sheet_key)
+    return _gc.open(sheet_name)
+
+def connect_google_sheets(sheet_name, gcp_service_account, sheet_key=None):
     if 'gc' not in st.session_state:
-        st.session_state['gc'] = gspread.service_account_from_dict(gcp_service_account)
+        st.session_state['gc'] = google_sheets_client(dict(gcp_service_account))
 
     if 'sh' not in st.session_state:
-        st.session_state['sh'] = st.session_state['gc'].open(sheet_name)
\ No newline at end of file
+        st.session_state['sh'] = google_spreadsheet(st.session_state['gc'], sheet_name, sheet_key)
+
+@st.cache_resource
+def sqlite_storage(path):
+    return sci_storage.SQLiteStorage(path)
+
+@st.cache_resource
+def custody_log(path):
+    return sci_custody.CustodyLog(path)
+
+@st.cache_resource
+def audit_log(path):
+    return sci_audit.AuditLog(path)
+
+def current_user():
+    """Email of the signed in viewer where the deployment provides one"""
+    return st.experimental_user.get('email') or ''
+
+@st.cache_resource
+def replica_storage(_sh, path, interval, flush_ops, audit_dir):
+    # The sync reads every table in one request, so worksheets an older spreadsheet lacks are added first
+    for table in sci_schema.database_structures:
+        sci_cache.get_worksheet(_sh, table)
+    sync = sci_sync.SheetsSync(_sh, sci_storage.SQLiteStorage(path), sci_schema.database_structures.keys(),
+                               interval, flush_ops, journal_path=f'{path}.journal')
+    # Set before the first push, which may already drop writes journaled by the previous run
+    sync.on_conflict = functools.partial(sci_audit.record_conflict, audit_log(audit_dir))
+    sync.start()
+    return sci_sync.ReplicaStorage(sync)
+
+def connect_storage(storage_settings=None):
+    """
+    Put the storage backend chosen by the [storage] secrets section in st.session_state['db']
+    backend = "sheets" (default) uses the spreadsheet opened by connect_google_sheets, reads are cached for ttl seconds
+    backend = "sqlite" uses the local database at path
+    backend = "replica" reads from a local copy at path, kept in sync with the spreadsheet every interval seconds,
+    writes return immediately and are pushed every interval seconds or once flush_ops of them are queued
+    Every write is recorded in the audit trail at audit_dir as the signed in user
+    """
+    if 'db' not in st.session_state:
+        storage_settings = storage_settings or {}
+        backend = storage_settings.get('backend', 'sheets')
+        if backend == 'sqlite':
+            storage = sqlite_storage(storage_settings.get('path', 'scispace.db'))
+        elif backend == 'replica':
+            storage = replica_storage(
+                st.session_state['sh'],
+                storage_settings.get('path', 'scispace_replica.db'),
+                storage_settings.get('interval', sci_sync.DEFAULT_INTERVAL),
+                storage_settings.get('flush_ops', sci_sync.DEFAULT_FLUSH_OPS),
+                st.secrets.get('audit_dir', 'audit'))
+        else:
+            storage = sci_storage.SheetsStorage(st.session_state['sh'], storage_settings.get('ttl', sci_cache.DEFAULT_TTL))
+        st.session_state['db'] = sci_audit.AuditedStorage(storage, audit_log(st.secrets.get('audit_dir', 'audit')), current_user())
+
+    if isinstance(st.session_state['db'].storage, sci_sync.ReplicaStorage):
+        sync_status(st.session_state['db'])
+
+def sync_status(db):
+    """Sidebar summary of writes waiting to be pushed to the spreadsheet"""
+    sync = db.storage.sync
+    status = sync.status()
+    with st.sidebar.expander(f'Sync: {status["pending"]} pending' if status['pending'] else 'Sync: up to date'):
+        if status['last_push']:
+            st.caption(f'Last push {time.strftime("%H:%M:%S", time.localtime(status["last_push"]))}')
+        if status['backoff']:
+            st.warning(f'Rate limited by Google Sheets, retrying in {status["backoff"]:.0f} s')
+        elif status['last_error']:
+            st.error(status['last_error'])
+        if status['conflicts']:
+            st.warning(f'{status["conflicts"]} local changes clash with newer remote edits, the remote values are shown until you keep yours')
+            for conflict in list(sync.conflicts):
+                sync_conflict(db, conflict)
+        st.button('Push Now', key='sync_flush', on_click=sync.flush, disabled=not status['pending'])
+
+
+def sync_conflict(db, conflict):
+    """One conflict from the replica push, with what each side holds and a choice of which to keep"""
+    key = f'sync_conflict_{conflict["table"]}_{conflict["id"]}_{conflict["time"]}'
+    if conflict['remote'] is None:
+        st.caption(f'{conflict["id"]} in {conflict["table"]} was removed remotely before your {conflict["op"]} was pushed')
+    elif conflict['op'] == 'insert':
+        st.caption(f'{conflict["id"]} in {conflict["table"]} was added remotely before yours was pushed')
+    elif conflict['op'] == 'delete':
+        st.caption(f'{conflict["id"]} in {conflict["table"]} was edited remotely before your delete was pushed')
+    else:
+        st.caption(f'{conflict["id"]} in {conflict["table"]} was edited remotely before your update was pushed')
+    columns = conflict['columns'] or list(conflict['record'])
+    if conflict['remote'] is not None and conflict['op'] != 'delete' and columns:
+        st.dataframe([{'column': col, 'yours': str(conflict['record'].get(col, '')), 'remote': conflict['remote'].get(col, '')}
+                      for col in columns], use_container_width=True)
+    col_mine, col_remote = st.columns(2)
+    col_mine.button('Keep Mine', key=f'{key}_mine', on_click=db.resolve_conflict, args=(conflict, True),
+                    disabled=conflict['remote'] is None)
+    col_remote.button('Keep Remote', key=f'{key}_remote', on_click=db.resolve_conflict, args=(conflict, False))
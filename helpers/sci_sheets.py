@@ -0,0 +1,178 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+from gspread.exceptions import APIError
+from gspread.utils import numericise, numericise_all, rowcol_to_a1
+
+# Sheets allows 60 write requests per minute per user, so chunked writes are spaced at least this far apart
+MIN_WRITE_INTERVAL = 1.0
+
+# Start of the last chunked write in this process, kept across calls so every chunk of an import is spaced
+_write_lock = threading.Lock()
+_last_write = 0.0
+
+
+class ConflictError(Exception):
+    """
+    Raised when a row changed underneath a write
+    current holds the row as it is now, or None if it was removed, and columns the cells both sides changed
+    """
+
+    def __init__(self, item_id, current, columns):
+        super().__init__(f'{item_id} was changed by someone else ({", ".join(columns)})' if current is not None
+                         else f'{item_id} was removed by someone else')
+        self.item_id = item_id
+        self.current = current
+        self.columns = columns
+
+
+def to_cell(value):
+    """Convert a DataFrame value into something the Sheets API will accept"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        # None, NaN, NaT and pd.NA all become empty cells
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return to_cell(value.item())
+    return value
+
+
+def batch_get_values(sh, worksheet_names):
+    """Values of several whole worksheets in a single values_batch_get request"""
+    ranges = ["'{}'".format(name.replace("'", "''")) for name in worksheet_names]
+    response = sh.values_batch_get(ranges)
+    return {name: value_range.get('values', []) for name, value_range in zip(worksheet_names, response['valueRanges'])}
+
+
+def records_from_values(values):
+    """The equivalent of worksheet.get_all_records() for values that have already been fetched"""
+    if not values:
+        return []
+    header = values[0]
+    return [
+        dict(zip(header, numericise_all((row + [''] * (len(header) - len(row)))[:len(header)])))
+        for row in values[1:]
+    ]
+
+
+def is_rate_limited(error):
+    return isinstance(error, APIError) and error.response.status_code == 429
+
+
+def with_backoff(func, *args, retries=5, base_delay=2.0, **kwargs):
+    """Call func, retrying with exponential backoff while Sheets answers 429 Too Many Requests"""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except APIError as e:
+            if not is_rate_limited(e) or attempt == retries:
+                raise
+            time.sleep(base_delay * 2 ** attempt)
+
+
+def same_value(a, b):
+    """Compare a cell as read from the sheet with a value from a record or DataFrame"""
+    return str(to_cell(numericise(a) if isinstance(a, str) else a)) == str(to_cell(numericise(b) if isinstance(b, str) else b))
+
+
+def find_row(worksheet, item_id, id_col=1):
+    """Return the 1-based row number of item_id, reading only the id column"""
+    ids = worksheet.col_values(id_col)
+    try:
+        return ids.index(item_id) + 1
+    except ValueError:
+        return None
+
+
+def append_row(worksheet, columns, item):
+    worksheet.append_row([to_cell(item.get(col)) for col in columns])
+
+
+def _wait_to_write():
+    global _last_write
+    with _write_lock:
+        wait = MIN_WRITE_INTERVAL - (time.monotonic() - _last_write)
+        if wait > 0:
+            time.sleep(wait)
+        _last_write = time.monotonic()
+
+
+def append_rows(worksheet, columns, records, chunk_size=500, progress=None):
+    """
+    Append records in chunks of chunk_size rows, one append call per chunk
+    Calls are spaced by MIN_WRITE_INTERVAL and retried when rate limited
+    """
+    for start in range(0, len(records), chunk_size):
+        _wait_to_write()
+        chunk = records[start:start + chunk_size]
+        with_backoff(worksheet.append_rows, [[to_cell(record.get(col)) for col in columns] for record in chunk])
+        if progress:
+            progress(start + len(chunk), len(records))
+
+
+def _read_row(worksheet, columns, item_id, id_col, retries):
+    """
+    Locate item_id and read its current cells with one row_values call
+    The row is read again if rows shifted between finding it and reading it
+    """
+    for _ in range(retries + 1):
+        row = find_row(worksheet, item_id, id_col)
+        if row is None:
+            return None, None
+        values = worksheet.row_values(row)
+        values = dict(zip(columns, values + [''] * (len(columns) - len(values))))
+        if values.get(columns[id_col - 1]) == item_id:
+            return row, values
+    raise ConflictError(item_id, None, [])
+
+
+def delete_row(worksheet, item_id, id_col=1, columns=None, before=None, retries=2):
+    """
+    Delete the row of item_id
+    When before and columns are given the row is only deleted if it still matches before,
+    otherwise ConflictError is raised
+    """
+    if before is None or columns is None:
+        row = find_row(worksheet, item_id, id_col)
+    else:
+        row, current = _read_row(worksheet, columns, item_id, id_col, retries)
+        if row is not None:
+            changed = [col for col in columns if col in before and not same_value(current[col], before[col])]
+            if changed:
+                raise ConflictError(item_id, current, changed)
+    if row is None:
+        return False
+    worksheet.delete_rows(row)
+    return True
+
+
+def update_row(worksheet, columns, item_id, before, after, id_col=1, retries=2):
+    """
+    Write only the cells that differ between before and after, as a compare and swap on before
+    The row is read first, cells changed remotely in other columns are kept (a merge) while a cell
+    changed both remotely and here raises ConflictError
+    Sheets has no conditional write, so this narrows the window for lost updates to one round trip
+    Returns the number of cells written, or None if item_id was not found
+    """
+    changed = [col for col in columns if to_cell(before.get(col)) != to_cell(after.get(col))]
+    if not changed:
+        return 0
+
+    row, current = _read_row(worksheet, columns, item_id, id_col, retries)
+    if row is None:
+        return None
+
+    conflicts = [col for col in changed if col in before
+                 and not same_value(current[col], before[col]) and not same_value(current[col], after.get(col))]
+    if conflicts:
+        raise ConflictError(item_id, current, conflicts)
+
+    worksheet.batch_update([
+        {'range': rowcol_to_a1(row, columns.index(col) + 1), 'values': [[to_cell(after.get(col))]]}
+        for col in changed
+    ])
+    return len(changed)
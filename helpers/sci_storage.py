@@ -0,0 +1,247 @@
+import sqlite3
+import threading
+
+from helpers import sci_cache, sci_ids, sci_schema, sci_sheets
+
+# Columns worth an index in the SQLite backend whenever a table has them
+_INDEXED_COLUMNS = ['category', 'type', 'location', 'owner', 'supplier', 'expiration_date', 'effective_date']
+
+_SQLITE_TYPES = {'string': 'TEXT', 'date': 'TEXT', 'int': 'INTEGER'}
+
+
+def _matches(record, filters):
+    return all(sci_sheets.to_cell(record.get(col)) == sci_sheets.to_cell(value) for col, value in filters.items())
+
+
+class SheetsStorage:
+    """
+    Storage backed by the worksheets of a Google Sheets spreadsheet
+    Reads are served from sci_cache, writes touch only the affected row
+    """
+
+    def __init__(self, sh, ttl=sci_cache.DEFAULT_TTL):
+        self.sh = sh
+        self.ttl = ttl
+
+    def _worksheet(self, table):
+        return sci_cache.get_worksheet(self.sh, table)
+
+    def columns(self, table):
+        return sci_cache.get_header(self.sh, table, self.ttl) or sci_schema.column_names(table)
+
+    def _write_columns(self, table, records):
+        """Columns to write records with, adding any schema column they have values for that the sheet lacks"""
+        columns = self.columns(table)
+        missing = sci_cache.missing_columns(columns, records, table)
+        return sci_cache.add_columns(self.sh, table, missing) if missing else columns
+
+    def list(self, table):
+        return sci_cache.get_all_records(self.sh, table, self.ttl)
+
+    def derived(self, table, name, build):
+        return sci_cache.get_derived(self.sh, table, name, build, self.ttl)
+
+    def prefetch(self, tables):
+        sci_cache.prefetch(self.sh, tables, self.ttl)
+
+    def get(self, table, item_id):
+        records = self.list(table)
+        position = self.derived(table, 'ids', sci_ids.IdIndex).position(item_id)
+        if position is not None and position < len(records) and str(records[position].get('id')) == str(item_id):
+            return records[position]
+        return None
+
+    def query(self, table, **filters):
+        return [record for record in self.list(table) if _matches(record, filters)]
+
+    def insert(self, table, record):
+        sci_sheets.append_row(self._worksheet(table), self._write_columns(table, [record]), record)
+        sci_cache.invalidate(self.sh, table)
+
+    def insert_many(self, table, records, progress=None):
+        try:
+            sci_sheets.append_rows(self._worksheet(table), self._write_columns(table, records), records, progress=progress)
+        finally:
+            sci_cache.invalidate(self.sh, table)
+
+    def update(self, table, item_id, changes, before=None):
+        """
+        Returns the number of cells written, or None if item_id was not found
+        Raises sci_sheets.ConflictError if a changed cell was also changed remotely since before was read
+        """
+        columns = self._write_columns(table, [changes])
+        before = before if before is not None else self.get(table, item_id) or {}
+        after = {**before, **changes}
+        try:
+            return sci_sheets.update_row(self._worksheet(table), columns, item_id, before, after, columns.index('id') + 1)
+        finally:
+            sci_cache.invalidate(self.sh, table)
+
+    def delete(self, table, item_id, before=None):
+        """With before, the row is only deleted if nobody changed it since it was read"""
+        columns = self.columns(table)
+        try:
+            return sci_sheets.delete_row(self._worksheet(table), item_id, columns.index('id') + 1, columns, before)
+        finally:
+            sci_cache.invalidate(self.sh, table)
+
+
+class SQLiteStorage:
+    """
+    Storage in a local SQLite database with one table per entry in database_structures
+    Columns that are not in the schema are added the first time a record uses them
+    """
+
+    def __init__(self, path, schema=None):
+        self.schema = schema if schema is not None else sci_schema.database_structures
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.RLock()
+        self._versions = {}
+        self._derived = {}
+        for table in self.schema:
+            self._create_table(table)
+
+    def _create_table(self, table):
+        fields = self.schema[table]
+        columns = ', '.join(
+            f'"{field["column_name"]}" {_SQLITE_TYPES.get(field["type"], "TEXT")}'
+            + (' PRIMARY KEY' if field.get('primary_key') else '')
+            for field in fields
+        )
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+        for field in fields:
+            if field['column_name'] in _INDEXED_COLUMNS:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{field["column_name"]}" ON "{table}" ("{field["column_name"]}")')
+
+    def _table_columns(self, table):
+        return [row['name'] for row in self._conn.execute(f'PRAGMA table_info("{table}")')]
+
+    def _ensure_columns(self, table, record):
+        existing = self._table_columns(table)
+        if not existing:
+            self._conn.execute(f'CREATE TABLE "{table}" ("id" TEXT PRIMARY KEY)')
+            existing = ['id']
+        for col in record:
+            if col not in existing:
+                self._conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}" TEXT')
+
+    def _changed(self, table):
+        self._versions[table] = self._versions.get(table, 0) + 1
+
+    def transaction(self):
+        """
+        Context manager grouping several writes into one SQLite transaction
+            with db.transaction():
+                db.insert(...)
+                db.delete(...)
+        """
+        return _Transaction(self)
+
+    def columns(self, table):
+        return self._table_columns(table) or sci_schema.column_names(table)
+
+    def list(self, table):
+        with self._lock:
+            if not self._table_columns(table):
+                return []
+            return [dict(row) for row in self._conn.execute(f'SELECT * FROM "{table}" ORDER BY rowid')]
+
+    def derived(self, table, name, build):
+        """build(records), recomputed only after the table has been written to"""
+        with self._lock:
+            version = self._versions.get(table, 0)
+            cached = self._derived.get((table, name))
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            value = build(self.list(table))
+            self._derived[(table, name)] = (version, value)
+            return value
+
+    def prefetch(self, tables):
+        pass
+
+    def get(self, table, item_id):
+        with self._lock:
+            row = self._conn.execute(f'SELECT * FROM "{table}" WHERE "id" = ?', (item_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def query(self, table, **filters):
+        where = ' AND '.join(f'"{col}" = ?' for col in filters) or '1'
+        with self._lock:
+            rows = self._conn.execute(f'SELECT * FROM "{table}" WHERE {where} ORDER BY rowid',
+                                      [sci_sheets.to_cell(value) for value in filters.values()])
+            return [dict(row) for row in rows]
+
+    def insert(self, table, record):
+        with self._lock:
+            self._ensure_columns(table, record)
+            cols = ', '.join(f'"{col}"' for col in record)
+            self._conn.execute(f'INSERT INTO "{table}" ({cols}) VALUES ({", ".join("?" * len(record))})',
+                               [sci_sheets.to_cell(value) for value in record.values()])
+            self._changed(table)
+
+    def insert_many(self, table, records, progress=None):
+        with self.transaction():
+            for record in records:
+                self.insert(table, record)
+        if progress:
+            progress(len(records), len(records))
+
+    def update(self, table, item_id, changes, before=None):
+        """
+        Returns the number of columns written, or None if item_id was not found
+        With before, the write is a compare and swap: a column changed both here and since before
+        was read raises sci_sheets.ConflictError, changes to other columns are kept
+        """
+        with self._lock:
+            if before is not None:
+                changes = {col: value for col, value in changes.items()
+                           if sci_sheets.to_cell(before.get(col)) != sci_sheets.to_cell(value)}
+            current = self.get(table, item_id)
+            if current is None:
+                return None
+            if not changes:
+                return 0
+            if before is not None:
+                conflicts = [col for col, value in changes.items() if col in before and col in current
+                             and not sci_sheets.same_value(current[col], before[col])
+                             and not sci_sheets.same_value(current[col], value)]
+                if conflicts:
+                    raise sci_sheets.ConflictError(item_id, current, conflicts)
+            self._ensure_columns(table, changes)
+            assignments = ', '.join(f'"{col}" = ?' for col in changes)
+            self._conn.execute(f'UPDATE "{table}" SET {assignments} WHERE "id" = ?',
+                               [sci_sheets.to_cell(value) for value in changes.values()] + [item_id])
+            self._changed(table)
+            return len(changes)
+
+    def delete(self, table, item_id, before=None):
+        with self._lock:
+            if before is not None:
+                current = self.get(table, item_id)
+                changed = [col for col in before if current is not None and col in current
+                           and not sci_sheets.same_value(current[col], before[col])]
+                if changed:
+                    raise sci_sheets.ConflictError(item_id, current, changed)
+            deleted = self._conn.execute(f'DELETE FROM "{table}" WHERE "id" = ?', (item_id,)).rowcount > 0
+            self._changed(table)
+            return deleted
+
+
+class _Transaction:
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage._lock.acquire()
+        self.storage._conn.execute('BEGIN')
+        return self.storage
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.storage._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.storage._lock.release()
@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from gspread.utils import numericise_all, rowcol_to_a1
+
+from helpers import sci_cache, sci_sheets
+
+# Seconds between polls of the spreadsheet for remote changes and pushes of local writes
+DEFAULT_INTERVAL = 30
+
+# Queued writes that trigger a push without waiting for the interval
+DEFAULT_FLUSH_OPS = 20
+
+# Longest wait between attempts while Sheets keeps answering 429
+MAX_BACKOFF = 300
+
+
+def row_hash(values):
+    return hashlib.sha1(json.dumps([str(sci_sheets.to_cell(v)) for v in values]).encode('utf-8')).hexdigest()
+
+
+def _remote_changed(base, remote, col):
+    """Whether col of the remote row changed since base, the row as it was pulled when the write was queued"""
+    if base is None:
+        # Queued before the row was first pulled, there is nothing to compare with
+        return False
+    if isinstance(base, str):
+        # Journals written before base rows were kept hold a hash of the whole row
+        return row_hash(list(remote.values())) != base
+    return not sci_sheets.same_value(base.get(col, ''), remote.get(col, ''))
+
+
+def _coalesce(previous, op):
+    """Merge a new pending op for an id into the one already queued, None means nothing is left to push"""
+    if previous is None:
+        return op
+    if op['op'] == 'delete':
+        if previous['op'] == 'insert':
+            return None
+        return {**op, 'base': previous['base']}
+    if previous['op'] == 'insert':
+        return {**previous, 'record': {**previous['record'], **op['record']}}
+    if previous['op'] == 'update':
+        return {**previous, 'record': {**previous['record'], **op['record']}}
+    # Re-inserting an id that was deleted locally becomes an update of the remote row
+    return {**op, 'op': 'update', 'base': previous['base']}
+
+
+class SheetsSync:
+    """
+    Keeps a SQLiteStorage replica in step with the worksheets of a spreadsheet
+
+    Pulls are skipped while the spreadsheet's Drive modifiedTime is unchanged, otherwise every
+    table is fetched in a single values_batch_get and only rows that changed are written to the
+    replica. Local writes are queued per id, with the row as it was last pulled as their base, and
+    pushed as one batch per worksheet. An update is merged cell by cell like sci_sheets.update_row:
+    cells only changed here are written, cells changed on both sides are kept in conflicts with
+    the remote value in place until the user picks one, as are an insert of an id that now exists
+    remotely and a delete of a row edited remotely.
+
+    Queued writes are appended to a JSON lines journal before enqueue returns, so they survive a
+    restart. A push runs every interval seconds, or as soon as flush_ops writes are queued, and
+    waits longer after each 429 from Sheets.
+    """
+
+    def __init__(self, sh, replica, tables, interval=DEFAULT_INTERVAL, flush_ops=DEFAULT_FLUSH_OPS, journal_path=None):
+        self.sh = sh
+        self.replica = replica
+        self.tables = list(tables)
+        self.interval = interval
+        self.flush_ops = flush_ops
+        self.journal_path = journal_path
+        self.conflicts = []
+        # Called with each new conflict, e.g. to record in the audit trail that a local write was overwritten
+        self.on_conflict = None
+        self.last_pull = None
+        self.last_push = None
+        self.last_error = None
+        self.backoff = 0
+        self.lock = threading.RLock()
+        self._pending = {table: {} for table in self.tables}
+        self._remote_rows = {table: {} for table in self.tables}
+        self._columns = {}
+        self._pulled = set()
+        self._remote_modified = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._replay_journal()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='sci_sync')
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def flush(self):
+        """Ask the background thread to push now instead of at the next interval"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.push()
+                self.pull()
+                self.last_error = None
+                self.backoff = 0
+            except Exception as e:
+                self.last_error = repr(e)
+                if sci_sheets.is_rate_limited(e):
+                    self.backoff = min(max(self.backoff * 2, self.interval), MAX_BACKOFF)
+            if self.backoff:
+                # Flush requests are ignored until the quota window has passed
+                self._stop.wait(self.backoff)
+            else:
+                self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def pending_count(self):
+        with self.lock:
+            return sum(len(ops) for ops in self._pending.values())
+
+    def status(self):
+        return {
+            'pending': self.pending_count(),
+            'conflicts': len(self.conflicts),
+            'last_pull': self.last_pull,
+            'last_push': self.last_push,
+            'last_error': self.last_error,
+            'backoff': self.backoff,
+        }
+
+    def _replay_journal(self):
+        """Queue the writes journaled by a previous run that were never pushed"""
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid write
+                    continue
+                self._queue(entry['table'], entry['id'], entry['op'])
+
+    def _journal(self, table, ops):
+        """Append (item id, op) pairs to the journal with one fsync"""
+        if self.journal_path:
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(json.dumps({'table': table, 'id': item_id, 'op': op}) + '\n' for item_id, op in ops))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _compact_journal(self):
+        """Rewrite the journal with only the writes still queued"""
+        if not self.journal_path:
+            return
+        with self.lock:
+            tmp_path = f'{self.journal_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                for table, ops in self._pending.items():
+                    for item_id, op in ops.items():
+                        f.write(json.dumps({'table': table, 'id': item_id, 'op': op}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+
+    def _queue(self, table, item_id, op):
+        pending = self._pending.setdefault(table, {})
+        merged = _coalesce(pending.get(item_id), op)
+        if merged is None:
+            pending.pop(item_id, None)
+        else:
+            pending[item_id] = merged
+
+    def enqueue(self, table, op, item_id, record=None):
+        """Queue a local write, op is insert, update or delete"""
+        self.enqueue_many(table, op, [(item_id, record)])
+
+    def enqueue_many(self, table, op, writes):
+        """Queue (item id, record) pairs written locally with one op, journaled together"""
+        with self.lock:
+            ops = [(item_id, {'op': op, 'record': {col: sci_sheets.to_cell(value) for col, value in (record or {}).items()},
+                              'base': self._remote_rows.get(table, {}).get(item_id)})
+                   for item_id, record in writes]
+            self._journal(table, ops)
+            for item_id, new_op in ops:
+                self._queue(table, item_id, new_op)
+            flush = self.pending_count() >= self.flush_ops
+        if flush:
+            self.flush()
+
+    def _modified_time(self):
+        try:
+            # Spreadsheet.lastUpdateTime keeps the time the spreadsheet was opened with, so Drive is asked on every poll
+            return self.sh.client._get_file_drive_metadata(self.sh.id)['modifiedTime']
+        except Exception:
+            # Drive metadata is unavailable, fall back to comparing row hashes on every poll
+            return None
+
+    def _fetch(self, tables):
+        return sci_sheets.batch_get_values(self.sh, tables)
+
+    def pull(self, force=False):
+        """Copy remote rows that changed since the last pull into the replica"""
+        modified = self._modified_time()
+        if not force and modified is not None and modified == self._remote_modified:
+            return
+        for table, values in self._fetch(self.tables).items():
+            self._apply_remote(table, values)
+        self._remote_modified = modified
+        self.last_pull = time.time()
+
+    def _apply_remote(self, table, values):
+        if not values:
+            return
+        columns = values[0]
+        rows = {}
+        for row in values[1:]:
+            row = (row + [''] * (len(columns) - len(row)))[:len(columns)]
+            record = dict(zip(columns, numericise_all(row)))
+            if record.get('id') != '':
+                rows[record['id']] = (dict(zip(columns, row)), record)
+
+        with self.lock:
+            self._columns[table] = columns
+            known = self._remote_rows[table]
+            pending = self._pending.get(table, {})
+            with self.replica.transaction():
+                for item_id, (cells, record) in rows.items():
+                    if known.get(item_id) == cells or item_id in pending:
+                        continue
+                    if self.replica.get(table, item_id) is None:
+                        self.replica.insert(table, record)
+                    else:
+                        self.replica.update(table, item_id, record)
+                if table in self._pulled:
+                    local_ids = set(known)
+                else:
+                    # Row hashes only live in memory, after a restart the replica itself shows what was deleted remotely
+                    local_ids = {record['id'] for record in self.replica.list(table)}
+                remote_ids = {str(item_id) for item_id in rows}
+                for item_id in local_ids:
+                    if str(item_id) not in remote_ids and item_id not in pending:
+                        self.replica.delete(table, item_id)
+            # A row with a write queued keeps the cells it was last pulled with, the replica still shows the local
+            # write, so the pull after the push applies whatever the push left remotely, including a lost conflict
+            self._remote_rows[table] = {item_id: known.get(item_id) if item_id in pending else cells
+                                        for item_id, (cells, _) in rows.items()
+                                        if item_id not in pending or item_id in known}
+            self._pulled.add(table)
+
+    def push(self):
+        """Write queued local changes to the spreadsheet, one batch per worksheet"""
+        with self.lock:
+            tables = [table for table, ops in self._pending.items() if ops]
+            batches = {table: self._pending[table] for table in tables}
+            self._pending.update({table: {} for table in tables})
+        if not tables:
+            return
+
+        remote = None
+        for i, table in enumerate(tables):
+            try:
+                if remote is None:
+                    remote = self._fetch(tables)
+                self._push_table(table, batches[table], remote[table])
+            except Exception:
+                self._requeue({table: batches[table] for table in tables[i:]})
+                self._compact_journal()
+                raise
+        self._compact_journal()
+        self.last_push = time.time()
+        self.pull(force=True)
+
+    def _conflict(self, table, item_id, op, columns, remote):
+        """
+        Keep a local write that lost to a remote edit so the user can choose between them
+        columns are the cells changed on both sides, remote is the row now, None if it was removed
+        """
+        conflict = {'table': table, 'id': item_id, 'op': op['op'], 'record': op['record'],
+                    'columns': columns, 'remote': remote, 'time': time.time()}
+        with self.lock:
+            self.conflicts.append(conflict)
+        if self.on_conflict:
+            self.on_conflict(conflict)
+
+    def resolve(self, conflict, keep_local):
+        """
+        Settle a conflict, with keep_local the local write is applied to the replica again and queued
+        against the remote row as it is now. Returns False when the row no longer exists remotely
+        """
+        with self.lock:
+            if conflict in self.conflicts:
+                self.conflicts.remove(conflict)
+            if not keep_local:
+                return True
+            table, item_id = conflict['table'], conflict['id']
+            if self._remote_rows.get(table, {}).get(item_id) is None:
+                return False
+            with self.replica.transaction():
+                if conflict['op'] == 'delete':
+                    self.replica.delete(table, item_id)
+                    self.enqueue(table, 'delete', item_id)
+                else:
+                    self.replica.update(table, item_id, conflict['record'])
+                    self.enqueue(table, 'update', item_id, conflict['record'])
+            return True
+
+    def _requeue(self, batches):
+        """Put unpushed ops back in front of anything queued since"""
+        with self.lock:
+            for table, ops in batches.items():
+                for item_id, op in ops.items():
+                    queued = self._pending[table].pop(item_id, None)
+                    merged = op if queued is None else _coalesce(op, queued)
+                    if merged is not None:
+                        self._pending[table][item_id] = merged
+
+    def _push_table(self, table, ops, values):
+        columns = values[0] if values else self._columns.get(table) or list(next(iter(ops.values()))['record'])
+        missing = sci_cache.missing_columns(columns, [op['record'] for op in ops.values()], table) if values else []
+        if missing:
+            columns = sci_cache.add_columns(self.sh, table, missing)
+        remote_rows = {}
+        for i, row in enumerate(values[1:], start=2):
+            row = (row + [''] * (len(columns) - len(row)))[:len(columns)]
+            if row[columns.index('id')] != '':
+                remote_rows[row[columns.index('id')]] = (i, dict(zip(columns, row)))
+
+        # Conflicting cells keep their remote value, the pull after the push brings it into the replica
+        updates, deletes, appends = [], [], []
+        for item_id, op in ops.items():
+            row_number, remote = remote_rows.get(str(item_id), (None, None))
+            if op['op'] == 'insert':
+                if remote is not None:
+                    self._conflict(table, item_id, op, [], remote)
+                else:
+                    appends.append([sci_sheets.to_cell(op['record'].get(col)) for col in columns])
+            elif op['op'] == 'delete':
+                if remote is None:
+                    continue
+                changed = [col for col in columns if _remote_changed(op['base'], remote, col)]
+                if changed:
+                    self._conflict(table, item_id, op, changed, remote)
+                else:
+                    deletes.append(row_number)
+            elif remote is None:
+                self._conflict(table, item_id, op, [], None)
+            else:
+                conflicts = []
+                for col, value in op['record'].items():
+                    if col not in columns or sci_sheets.same_value(remote[col], value):
+                        continue
+                    if _remote_changed(op['base'], remote, col):
+                        conflicts.append(col)
+                    else:
+                        updates.append({'range': rowcol_to_a1(row_number, columns.index(col) + 1),
+                                        'values': [[sci_sheets.to_cell(value)]]})
+                if conflicts:
+                    self._conflict(table, item_id, {**op, 'record': {col: op['record'][col] for col in conflicts}}, conflicts, remote)
+
+        worksheet = sci_cache.get_worksheet(self.sh, table)
+        if updates:
+            sci_sheets.with_backoff(worksheet.batch_update, updates)
+        if deletes:
+            # Delete from the bottom up so earlier row numbers stay valid
+            sci_sheets.with_backoff(self.sh.batch_update, {'requests': [
+                {'deleteDimension': {'range': {'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': row - 1, 'endIndex': row}}}
+                for row in sorted(deletes, reverse=True)
+            ]})
+        if appends:
+            sci_sheets.with_backoff(worksheet.append_rows, appends)
+
+
+class ReplicaStorage:
+    """
+    Storage that serves every read from the local replica and pushes writes through SheetsSync
+    Page reruns never wait on the network
+    """
+
+    def __init__(self, sync):
+        self.sync = sync
+        self.replica = sync.replica
+
+    def columns(self, table):
+        return self.replica.columns(table)
+
+    def list(self, table):
+        return self.replica.list(table)
+
+    def derived(self, table, name, build):
+        return self.replica.derived(table, name, build)
+
+    def prefetch(self, tables):
+        pass
+
+    def get(self, table, item_id):
+        return self.replica.get(table, item_id)
+
+    def query(self, table, **filters):
+        return self.replica.query(table, **filters)
+
+    # Writes hold the sync lock so a pull cannot land between the local write and its queued op.
+    # The op is journaled inside the replica transaction, before it commits, so a crash can lose
+    # neither a write the replica shows nor one the journal would push without it
+
+    def insert(self, table, record):
+        self.insert_many(table, [record])
+
+    def insert_many(self, table, records, progress=None):
+        with self.sync.lock, self.replica.transaction():
+            for record in records:
+                self.replica.insert(table, record)
+            self.sync.enqueue_many(table, 'insert', [(record['id'], dict(record)) for record in records])
+        if progress:
+            progress(len(records), len(records))
+
+    def resolve_conflict(self, conflict, keep_local):
+        return self.sync.resolve(conflict, keep_local)
+
+    def update(self, table, item_id, changes, before=None):
+        if before is not None:
+            changes = {col: value for col, value in changes.items()
+                       if sci_sheets.to_cell(before.get(col)) != sci_sheets.to_cell(value)}
+        with self.sync.lock, self.replica.transaction():
+            # The replica applies the compare and swap against before, the push repeats it remotely
+            updated = self.replica.update(table, item_id, changes, before)
+            if updated:
+                self.sync.enqueue(table, 'update', item_id, changes)
+        return updated
+
+    def delete(self, table, item_id, before=None):
+        with self.sync.lock, self.replica.transaction():
+            deleted = self.replica.delete(table, item_id, before)
+            if deleted:
+                self.sync.enqueue(table, 'delete', item_id)
+        return deleted
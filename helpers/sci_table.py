@@ -0,0 +1,62 @@
+import math
+
+import streamlit as st
+
+from helpers import sci_trace
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+# Number of values listed per facet column
+FACET_LIMIT = 8
+
+
+def _set_page(key, page):
+    st.session_state[f'{key}_page'] = page
+
+
+def facet_counts(df, columns, limit=FACET_LIMIT):
+    """Most common values of each column, computed server side"""
+    return {col: df[col].value_counts().head(limit) for col in columns if col in df.columns}
+
+
+def paginated_dataframe(df, key, display_columns=None, facet_columns=(), reset_on=None, **dataframe_kwargs):
+    """
+    Show one page of df with sorting and paging controls
+    Only the rows on the current page are serialized and sent to the browser
+    The page cursor returns to the first page whenever reset_on changes, e.g. a new search term
+    """
+    total = len(df)
+    display_columns = list(display_columns) if display_columns is not None else list(df.columns)
+
+    col_sort, col_order, col_size = st.columns(3)
+    sort_column = col_sort.selectbox('Sort by', [None] + display_columns, format_func=lambda x: '-' if x is None else x, key=f'{key}_sort')
+    descending = col_order.selectbox('Order', ['Ascending', 'Descending'], key=f'{key}_order') == 'Descending'
+    page_size = col_size.selectbox('Rows per page', PAGE_SIZES, key=f'{key}_page_size')
+
+    num_pages = max(1, math.ceil(total / page_size))
+    if st.session_state.get(f'{key}_reset_on') != reset_on:
+        st.session_state[f'{key}_reset_on'] = reset_on
+        _set_page(key, 0)
+    page = min(st.session_state.get(f'{key}_page', 0), num_pages - 1)
+
+    if sort_column is not None:
+        df = df.sort_values(sort_column, ascending=not descending, kind='stable', na_position='last')
+    start = page * page_size
+    page_df = df.iloc[start:start + page_size][display_columns]
+    with sci_trace.span('st.dataframe', rows=len(page_df)) as s:
+        s.size = int(page_df.memory_usage(deep=True).sum())
+        st.dataframe(page_df, **dataframe_kwargs)
+
+    col_prev, col_position, col_next = st.columns([1, 4, 1])
+    col_prev.button('Previous', key=f'{key}_prev', disabled=page == 0, on_click=_set_page, args=(key, page - 1))
+    col_next.button('Next', key=f'{key}_next', disabled=page >= num_pages - 1, on_click=_set_page, args=(key, page + 1))
+    if total:
+        col_position.caption(f'Rows {start + 1}-{min(start + page_size, total)} of {total}, page {page + 1} of {num_pages}')
+    else:
+        col_position.caption('No matching rows')
+
+    facets = facet_counts(df, facet_columns)
+    if facets:
+        with st.expander('Summary'):
+            for col, counts in facets.items():
+                st.caption(f'**{col}**: ' + ', '.join(f'{value} ({count})' for value, count in counts.items() if count))
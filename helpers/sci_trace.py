@@ -0,0 +1,161 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Process wide totals per span name, written out as Prometheus counters
+_lock = threading.Lock()
+_totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'bytes': 0})
+
+# Spans of the rerun running on this thread
+_local = threading.local()
+
+
+class span:
+    """
+    Time a block and record it in the current rerun and the process totals
+        with sci_trace.span('sheets.read', worksheet=name) as s:
+            records = ...
+            s.size = len(records)
+    size is whatever payload measure fits, bytes or rows
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.size = None
+
+    def __enter__(self):
+        self.depth = getattr(_local, 'depth', 0)
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.depth = self.depth
+        record(self.name, time.perf_counter() - self.start, self.size, error=exc_type is not None,
+               depth=self.depth, **self.labels)
+
+
+def traced(name, size=None):
+    """Decorator form of span, size(result) gives the payload size of the return value"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as s:
+                result = func(*args, **kwargs)
+                if size is not None:
+                    s.size = size(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def record(name, seconds, size=None, error=False, depth=0, **labels):
+    with _lock:
+        totals = _totals[name]
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['bytes'] += size or 0
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append({'name': name, 'seconds': seconds, 'size': size, 'error': error, 'depth': depth, **labels})
+
+
+def record_response(response, *args, **kwargs):
+    """requests response hook counting every Google API call with its payload size"""
+    record('api.' + response.request.method.lower(), response.elapsed.total_seconds(), len(response.content),
+           error=not response.ok, status=response.status_code)
+
+
+def bind(func):
+    """Wrap func so spans it records on another thread are added to the caller's rerun"""
+    spans = getattr(_local, 'spans', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.spans = spans
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.spans = None
+    return wrapper
+
+
+def start_rerun(page):
+    _local.page = page
+    _local.spans = []
+    _local.depth = 0
+    _local.started = time.perf_counter()
+
+
+def rerun_spans():
+    return list(getattr(_local, 'spans', None) or [])
+
+
+def summarize(spans):
+    """Calls, seconds and size per span name, slowest first"""
+    summary = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'size': 0})
+    for s in spans:
+        summary[s['name']]['calls'] += 1
+        summary[s['name']]['seconds'] += s['seconds']
+        summary[s['name']]['size'] += s['size'] or 0
+    return dict(sorted(summary.items(), key=lambda item: -item[1]['seconds']))
+
+
+def write_jsonl(path, page, spans, seconds):
+    with open(path, 'a') as f:
+        f.write(json.dumps({'time': time.time(), 'page': page, 'seconds': seconds, 'spans': spans}, default=str) + '\n')
+
+
+def write_prometheus(path):
+    with _lock:
+        totals = {name: dict(values) for name, values in _totals.items()}
+    lines = []
+    for metric, field, help_text in [('scispace_span_calls_total', 'calls', 'Number of traced calls'),
+                                     ('scispace_span_seconds_total', 'seconds', 'Time spent in traced calls'),
+                                     ('scispace_span_size_total', 'bytes', 'Payload size of traced calls')]:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        lines += [f'{metric}{{name="{name}"}} {values[field]}' for name, values in sorted(totals.items())]
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+def finish_rerun():
+    """
+    Write this rerun's spans to the files configured in the [trace] secrets section and,
+    with panel = true, show them in the sidebar
+        [trace]
+        panel = true
+        jsonl_path = "trace.jsonl"
+        prometheus_path = "metrics.prom"
+    """
+    import streamlit as st
+
+    settings = st.secrets.get('trace', {})
+    spans = rerun_spans()
+    seconds = time.perf_counter() - getattr(_local, 'started', time.perf_counter())
+    _local.spans = None
+    if settings.get('jsonl_path'):
+        write_jsonl(settings['jsonl_path'], getattr(_local, 'page', None), spans, seconds)
+    if settings.get('prometheus_path'):
+        write_prometheus(settings['prometheus_path'])
+    if settings.get('panel'):
+        debug_panel(spans, seconds)
+
+
+def debug_panel(spans, seconds):
+    import streamlit as st
+
+    summary = summarize(spans)
+    api_calls = sum(values['calls'] for name, values in summary.items() if name.startswith('api.'))
+    with st.sidebar.expander(f'Trace: {seconds * 1000:.0f} ms, {api_calls} API calls'):
+        st.dataframe([{'name': name, 'calls': values['calls'], 'ms': round(values['seconds'] * 1000, 1), 'size': values['size']}
+                      for name, values in summary.items()], use_container_width=True)
+        st.caption('Spans in order')
+        st.text('\n'.join(f'{"  " * s["depth"]}{s["name"]} {s["seconds"] * 1000:.1f} ms'
+                          + (f' size={s["size"]}' if s['size'] is not None else '') for s in spans))
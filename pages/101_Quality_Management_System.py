@@ -1,6 +1,6 @@
 import streamlit as st
 
-from helpers import sci_setup
+from helpers import sci_setup, sci_trace
 
 sci_setup.setup_page("Quality Management System")
 sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets["gcp_service_account"])
@@ -366,4 +366,5 @@ lqms_structure = [
 ]
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
+    sci_trace.finish_rerun()
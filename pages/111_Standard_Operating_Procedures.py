@@ -2,34 +2,27 @@ import streamlit as st
 
 import pandas as pd
 from io import BytesIO
-from uuid import uuid4
-import json
 
-import fitz
-
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.styles import ParagraphStyle, ListStyle, getSampleStyleSheet
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, PageTemplate, Frame, Table, TableStyle, ListFlowable, ListItem
-from reportlab.platypus.flowables import HRFlowable, Spacer
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
-pdf_styles = getSampleStyleSheet()
-
-from helpers import sci_report, sci_setup
+from helpers import sci_export, sci_render, sci_report, sci_schema, sci_search, sci_setup, sci_table, sci_trace
 
 sci_setup.setup_page("Standard Operating Procedures")
 sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets["gcp_service_account"])
+sci_setup.connect_storage(st.secrets.get('storage'))
+
+# Preview resolutions, pages are rasterized on demand at the selected DPI
+PREVIEW_DPIS = [72, 110, 150, 200]
+THUMBNAIL_DPI = 20
+THUMBNAILS_PER_ROW = 8
+
+
+@st.cache_resource
+def sop_render_cache():
+    return sci_render.RenderCache(disk_dir=st.secrets.get('render_cache_dir'))
+
 
 def main():
 
-    sop_categories = {
-            'Quality Assurance and Control': 'QU',
-            'Equipment': 'EQ',
-            'Analytical': 'AN',
-            'Procedure': 'PR',
-            'Safety': 'SA'
-        }
+    sop_categories = sci_report.sop_categories
         
     # sop_tags = {
     #     'tag_qc_qa': 'QC and QA',
@@ -55,33 +48,29 @@ def main():
 
     st.warning("SOP database is currently under construction. Everything on this page is subject to change.")
 
-    worksheet = st.session_state['sh'].worksheet('sops')
+    db = st.session_state['db']
 
-    # Fetch existing data
-    df = pd.DataFrame(worksheet.get_all_records())
-    df.dropna(how='all', inplace=True)
-    df = df[[col for col in df.columns if 'Unnamed' not in col]]
-    df.sort_values(by=['id'], inplace=True)
-    df.reset_index(drop=True, inplace=True)
+    # Fetch existing data, the frame and search index are only rebuilt when the data changes
+    df, search_index = db.derived('sops', 'search', build_search_index)
 
     # Filter options
-    filter_term = st.text_input(f'Search', key=f'sop_search')
+    filter_term = st.text_input(f'Search', key=f'sop_search', help=sci_search.SEARCH_HELP)
 
     filter_category = st.multiselect('Filter by Category', sop_categories.keys(), default=list(sop_categories.keys()))
 
     # Apply filters
-    df_filter = df.copy()
 
-    # Find rows which contain the filter term in any column
-    df_filter = df_filter[df_filter.astype(str).sum(axis=1).str.contains(filter_term, case=False)]
+    # Find rows which contain every search term
+    df_filter = search_index.search(df, filter_term)
 
     # Find rows where the category is in the filter_category list
     df_filter = df_filter[df_filter['category'].isin(filter_category)]
 
     #Display filtered data
-    st.dataframe(df_filter[['id', 'title', 'purpose']], use_container_width=True)
+    sci_table.paginated_dataframe(df_filter, 'sops', display_columns=['id', 'title', 'purpose'], facet_columns=['category'],
+                                  reset_on=(filter_term, tuple(filter_category)), use_container_width=True)
 
-    view, create = st.tabs(['View', 'Create'])
+    view, create, export = st.tabs(['View', 'Create', 'Export'])
     with view:
         view_id = st.selectbox('SOP ID', df_filter['id'].values, format_func=lambda x: f'{x} - {df_filter[df_filter["id"] == x]["title"].values[0]}')
         if view_id:
@@ -90,111 +79,37 @@ def main():
                 query_df_t = query_df.T
                 query_df_t.columns = ['value']
 
-                query_dict = query_df_t.to_dict()['value']
-                for k, v in query_dict.items():
-                    try:
-                        query_dict[k] = json.loads(v)
-                    except:
-                        pass
+                record = query_df_t.to_dict()['value']
 
-                # Create a PDF
-                buffer = BytesIO()
-                doc = SimpleDocTemplate(buffer)
-                
-                # Create a list of elements to add to the PDF
-                elements = []
-                hr = [Spacer(1, 10), HRFlowable(width="100%")]
-               
-                # ID and Title
-                elements.append(Paragraph(query_dict['id'], pdf_styles['Normal']))
-                elements.append(Paragraph(query_dict["title"], pdf_styles['Heading1']))
-                elements += hr
-                
-                # Purpose
-                elements.append(Paragraph("Purpose", pdf_styles['Heading2']))
-                elements.append(Paragraph(query_dict["purpose"], pdf_styles['Normal']))
-                elements += hr
-                
-                # Scope
-                elements.append(Paragraph("Scope", pdf_styles['Heading2']))
-                elements.append(Paragraph("Covered", pdf_styles['Heading3']))
-                for x in query_dict["scope_covered"]:
-                    elements.append(Paragraph(f"• {x}", pdf_styles['Normal']))
-                elements.append(Paragraph("Not covered", pdf_styles['Heading3']))
-                for x in query_dict["scope_not_covered"]:
-                    elements.append(Paragraph(f"• {x}", pdf_styles['Normal']))
-                elements += hr
-                
-                # Applications
-                elements.append(Paragraph("Applications", pdf_styles['Heading2']))
-                elements.append(Paragraph(query_dict["applications"], pdf_styles['Normal']))
-                elements += hr
-                
-                # Definitions
-                elements.append(Paragraph("Definitions", pdf_styles['Heading2']))
-                for k, v in query_dict["definitions"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements += hr
-                
-                # Responsibilities
-                elements.append(Paragraph("Responsibilities", pdf_styles['Heading2']))
-                for k, v in query_dict["responsibilities"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements += hr
-               
-                # Procedure
-                elements.append(Paragraph("Procedure", pdf_styles['Heading2']))
-                for k, v in query_dict["procedure"].items():
-                    elements.append(Paragraph(k, pdf_styles['Heading3']))
-                    for x in v:
-                        elements.append(Paragraph(f"• {x}", pdf_styles['Normal']))
-                elements += hr
-                
-                # Health and Safety
-                elements.append(Paragraph("Health and Safety", pdf_styles['Heading2']))
-                elements.append(Paragraph("PPE", pdf_styles['Heading3']))
-                for k, v in query_dict["ppe"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements.append(Paragraph("Hazards and mitigation", pdf_styles['Heading3']))
-                for k, v in query_dict["hazards_and_mitigation"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements.append(Paragraph("Emergency procedures", pdf_styles['Heading3']))
-                for k, v in query_dict["emergency_procedures"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements += hr
-
-                # Related Documents
-                elements.append(Paragraph("Related Documents", pdf_styles['Heading2']))
-                for k, v in query_dict["related_documents"].items():
-                    elements.append(Paragraph(f"<b>{k}:</b> {v}", pdf_styles['Normal']))
-                elements += hr
-
-                # Revision History
-                elements.append(Paragraph("Revision History", pdf_styles['Heading2']))
-                revision_history = pd.DataFrame(query_dict["revision_history"])
-                revision_history.columns = [" ".join(i.split("_")).capitalize() for i in revision_history.columns]
-                elements.append(sci_report.df2table(revision_history))
-                elements += hr
-
-                # Build the PDF document
-                doc.build(elements, canvasmaker=sci_report.NumberedCanvas)
-                pdf_bytes = buffer.getbuffer().tobytes()
-                # pdf_base64 = base64.b64encode(pdf_bytes).decode("utf-8")
-
-                # Use fitz to convert PDF to PNG
-                pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-                pdf_pngs = []
-                for page in pdf_document:
-                    pix = page.get_pixmap()
-                    png = pix.tobytes("png")
-                    pdf_pngs.append(png)
+                # Rendering is skipped when this exact SOP record has been viewed before
+                render_key = sci_render.content_key(record, sci_report.sop_template_version)
+                pdf_bytes = sci_render.cached_pdf(sop_render_cache(), render_key, lambda: sci_report.build_sop_pdf(record))
+                num_pages = sci_render.page_count(sop_render_cache(), render_key, pdf_bytes)
 
                 with st.expander("PDF", expanded=True):
-                    st.download_button("Download PDF", data=pdf_bytes, file_name=f"{query_dict['id']} - {query_dict['title']}.pdf")
-                    for i, png in enumerate(pdf_pngs):
-                        st.image(png, caption=f"Page {i+1}")
+                    st.download_button("Download PDF", data=pdf_bytes, file_name=f"{record['id']} - {record['title']}.pdf")
+
+                    col_page, col_dpi = st.columns(2)
+                    page_number = col_page.number_input('Page', min_value=1, max_value=num_pages, value=1, key=f'{view_id}_preview_page')
+                    dpi = col_dpi.select_slider('Resolution (DPI)', PREVIEW_DPIS, value=PREVIEW_DPIS[1], key='sop_preview_dpi')
+
+                    # Only the selected page is rasterized at full resolution
+                    page_png = sci_render.submit_page(sop_render_cache(), render_key, pdf_bytes, page_number, dpi)
+
+                    # Low resolution thumbnails for navigation
+                    thumbnails = sci_render.render_pages(sop_render_cache(), render_key, pdf_bytes, range(1, num_pages + 1), THUMBNAIL_DPI)
+                    for row_start in range(0, num_pages, THUMBNAILS_PER_ROW):
+                        for offset, col in enumerate(st.columns(THUMBNAILS_PER_ROW)):
+                            i = row_start + offset
+                            if i < num_pages:
+                                col.image(thumbnails[i], caption=f"Page {i + 1}", use_column_width=True)
+
+                    st.image(page_png.result(), caption=f"Page {page_number} of {num_pages}")
+
+                    # Warm the next page while the user reads this one
+                    if page_number < num_pages:
+                        sci_render.submit_page(sop_render_cache(), render_key, pdf_bytes, page_number + 1, dpi)
 
-                
                 # # Embedding PDF in HTML
                 # pdf_display = f'<iframe src="data:application/pdf;base64,{pdf_base64}" width="600" height="900" type="application/pdf"></iframe>'
 
@@ -252,6 +167,23 @@ def main():
                 # print(md)
                 # st.markdown(md, unsafe_allow_html=True)
 
+    with export:
+        st.caption('Export the current version of every SOP in the selected categories')
+        export_categories = st.multiselect('Categories', sop_categories.keys(), default=list(sop_categories.keys()), key='sop_export_categories')
+        export_merged = st.checkbox('Merge into a single bookmarked PDF', key='sop_export_merged')
+        if st.button('Export SOPs'):
+            records = sci_export.current_sops(db.list('sops'), export_categories)
+            if not records:
+                st.info('No SOPs in the selected categories.')
+            else:
+                export_progress = st.progress(0.0)
+                buffer = BytesIO()
+                errors = sci_export.export_sops(records, buffer, export_merged,
+                                                progress=lambda done, total: export_progress.progress(done / total))
+                for sop_id, error in errors.items():
+                    st.error(f'{sop_id} could not be rendered: {error}')
+                st.download_button('Download zip', data=buffer.getvalue(), file_name='SOPs.zip')
+
     # with create:
 
     #     sop_dict = {
@@ -344,5 +276,15 @@ def main():
     #         st.success(f'Successfully added SOP: {sop_id}')
 
 
+def build_search_index(records):
+    df = sci_schema.to_frame(records, 'sops')
+    df.dropna(how='all', inplace=True)
+    df = df[[col for col in df.columns if 'Unnamed' not in col]]
+    df.sort_values(by=['id'], inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    return df, sci_search.SearchIndex(df)
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
+    sci_trace.finish_rerun()
@@ -1,12 +1,15 @@
 import streamlit as st
 import pandas as pd
-from uuid import uuid4
 from collections import defaultdict
 
-from helpers import sci_setup
+from helpers import sci_custody, sci_ids, sci_import, sci_locations, sci_schema, sci_search, sci_setup, sci_sheets, sci_table, sci_trace
 
 sci_setup.setup_page('Inventory Management')
 sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets['gcp_service_account'])
+sci_setup.connect_storage(st.secrets.get('storage'))
+
+# Warm the cache for the other inventory categories after the selected one is shown
+PREFETCH_INVENTORY = True
 
 
 def main():
@@ -20,61 +23,53 @@ def main():
     - Equipment (microscopes, centrifuges, etc.)
     """)    
 
-    tab_reagents, tab_samples, tab_supplies, tab_equipment = st.tabs(['Reagents', 'Samples', 'Supplies', 'Equipment'])
-    
-    with tab_reagents:
-        manage_inventory("inventory_reagents")
+    inventory_types = {
+        'Reagents': 'inventory_reagents',
+        'Samples': 'inventory_samples',
+        'Supplies': 'inventory_supplies',
+        'Equipment': 'inventory_equipment',
+    }
 
-    with tab_samples:
-        manage_inventory("inventory_samples")
+    # Only the selected category is fetched, the rest are warmed in the background
+    category = st.radio('Inventory', inventory_types.keys(), horizontal=True, label_visibility='collapsed')
+    inventory_type = inventory_types[category]
 
-    with tab_supplies:
-        manage_inventory("inventory_supplies")
+    manage_inventory(inventory_type)
 
-    with tab_equipment:
-        manage_inventory("inventory_equipment")
+    if PREFETCH_INVENTORY:
+        st.session_state['db'].prefetch([t for t in inventory_types.values() if t != inventory_type])
 
 
 def manage_inventory(inventory_type):
-    abvs = {
-        'inventory_reagents': 'RE',
-        'inventory_samples': 'SA',
-        'inventory_supplies': 'SU',
-        'inventory_equipment': 'EQ'
-    }
-
-    # Get the Google Sheet
-    worksheet = st.session_state['sh'].worksheet(inventory_type)
+    db = st.session_state['db']
 
-    # Fetch existing data
-    df = pd.DataFrame(worksheet.get_all_records())
+    # Fetch existing data, the frame and indexes are only rebuilt when the data changes
+    df, search_index = db.derived(inventory_type, 'search', lambda records: build_search_index(records, inventory_type))
+    ids = sci_ids.id_index(db, inventory_type)
 
     # Search
-    search_term = st.text_input(f'Search', key=f'{inventory_type}_search')
+    search_term = st.text_input(f'Search', key=f'{inventory_type}_search', help=sci_search.SEARCH_HELP)
     # available_applications = list(set(worksheet.col_values(3)))
     # filter_application = st.multiselect('Filter by Application', available_applications, default=available_applications, key=f'{inventory_type}_filter_application')
 
 
-    # Display existing data
-    search_df = df[df.astype(str).apply(lambda x: x.str.contains(search_term, case=False).any(), axis=1)]
-    st.dataframe(search_df)
+    # Display existing data, a location term also matches the names of storage locations and everything inside them
+    tree = sci_locations.location_tree(db)
+    search_df = search_index.search(df, search_term, aliases={'location': tree.matching})
+    sci_table.paginated_dataframe(search_df, inventory_type, facet_columns=sorted(sci_schema.categorical_columns), reset_on=search_term)
+
+    tab_add, tab_remove, tab_update, tab_import, tab_locations = st.tabs(['Add', 'Remove', 'Update', 'Import', 'Locations'])
 
-    tab_add, tab_remove, tab_update = st.tabs(['Add', 'Remove', 'Update'])
     with tab_add:
         new_item = pd.DataFrame().from_dict(
-            {field['column_name']: None for field in database_structures[inventory_type][1:]}, orient='index').T
+            {field['column_name']: None for field in sci_schema.database_structures[inventory_type][1:]}, orient='index').T
         new_item = st.data_editor(new_item)
         if st.button('Add Item', key=f'{inventory_type}_add'):
             new_item = new_item.to_dict('records')[0]
-            new_item['id'] = f'{abvs[inventory_type]}-{str(uuid4())[:6]}'
-
-            # Append new SOP to the dataframe
-            df = df.append(new_item, ignore_index=True)
+            new_item['id'] = sci_ids.allocate(db, inventory_type)
 
-            # Save updated dataframe to Google Sheets
-            worksheet.clear()
-            worksheet.update([df.columns.values.tolist()] + df.values.tolist())
-            # set_with_dataframe(worksheet, df)
+            # Append the new row
+            db.insert(inventory_type, new_item)
 
             # Display success message
             new_item_name = new_item['name']
@@ -83,27 +78,182 @@ def manage_inventory(inventory_type):
     with tab_remove:
         remove_id = st.text_input(f'Item ID', key=f'{inventory_type}_remove_id')
         if remove_id:
-            st.dataframe(df[df['id'] == remove_id])
+            remove_item = ids.row(df, remove_id)
+            st.dataframe(remove_item)
             if st.button('Remove Selected Item', key=f'{inventory_type}_remove'):
-                df = df[df['id'] != remove_id]
-                worksheet.clear()
-                worksheet.update([df.columns.values.tolist()] + df.values.tolist())
-                # set_with_dataframe(worksheet, df)
-                st.success(f'Successfully removed {remove_id} from {inventory_type}.')
+                try:
+                    # Compared as stored, the typed frame may have reformatted dates and numbers
+                    removed = db.delete(inventory_type, remove_id, before=db.get(inventory_type, remove_id))
+                except sci_sheets.ConflictError as e:
+                    st.error(f'{e}. Check the current values above and remove again if it is still wanted.')
+                else:
+                    if removed:
+                        st.success(f'Successfully removed {remove_id} from {inventory_type}.')
+                    else:
+                        st.error(f'{remove_id} was not found in {inventory_type}.')
         
     with tab_update:
         update_id = st.text_input(f'Item ID', key=f'{inventory_type}_update_id')
         if update_id:
-            update_item = df[df['id'] == update_id]
-            update_item = st.data_editor(update_item, key=f'{inventory_type}_update_item')
-            if st.button('Update Selected Item', key=f'{inventory_type}_update'):
-                update_item = update_item.to_dict('records')[0]
-                df = df[df['id'] != update_id]
-                df = df.append(update_item, ignore_index=True)
-                worksheet.clear()
-                worksheet.update([df.columns.values.tolist()] + df.values.tolist())
-                # set_with_dataframe(worksheet, df)
-                st.success(f'Successfully updated {update_id} in {inventory_type}.')
+            update_item = ids.row(df, update_id)
+            original_item = update_item.to_dict('records')
+            update_item = st.data_editor(sci_schema.editable(update_item), key=f'{inventory_type}_update_item')
+            if original_item and st.button('Update Selected Item', key=f'{inventory_type}_update'):
+                # Only the cells edited are written, compared against the record as stored rather than the typed frame
+                update_item = {col: value for col, value in update_item.to_dict('records')[0].items()
+                               if not sci_sheets.same_value(original_item[0].get(col), value)}
+                stored_item = db.get(inventory_type, update_id)
+                try:
+                    updated = db.update(inventory_type, update_id, update_item, before=stored_item)
+                except sci_sheets.ConflictError as e:
+                    st.session_state[f'{inventory_type}_conflict'] = (e, update_item)
+                else:
+                    show_update_result(inventory_type, update_id, updated)
+                    record_custody(inventory_type, update_id, stored_item or {}, {**(stored_item or {}), **update_item}, updated)
+
+            # Both sides changed the same cells, let the user pick which values to keep
+            conflict = st.session_state.get(f'{inventory_type}_conflict')
+            if conflict and conflict[0].item_id == update_id:
+                e, update_item = conflict
+                st.warning(f'{e}. Choose which values to keep.')
+                st.dataframe(pd.DataFrame({
+                    'Your value': [sci_sheets.to_cell(update_item.get(col)) for col in e.columns],
+                    'Current value': [e.current.get(col) for col in e.columns],
+                }, index=e.columns).astype(str))
+                col_mine, col_theirs = st.columns(2)
+                if col_mine.button('Keep My Values', key=f'{inventory_type}_conflict_mine'):
+                    del st.session_state[f'{inventory_type}_conflict']
+                    try:
+                        updated = db.update(inventory_type, update_id, update_item, before=e.current)
+                    except sci_sheets.ConflictError as again:
+                        st.session_state[f'{inventory_type}_conflict'] = (again, update_item)
+                        st.experimental_rerun()
+                    show_update_result(inventory_type, update_id, updated)
+                    record_custody(inventory_type, update_id, e.current or {}, {**(e.current or {}), **update_item}, updated)
+                if col_theirs.button('Keep Current Values', key=f'{inventory_type}_conflict_theirs'):
+                    del st.session_state[f'{inventory_type}_conflict']
+                    st.experimental_rerun()
+
+    with tab_import:
+        st.caption('Upload a CSV or XLSX file with one item per row and the column names as the header. '
+                   'Rows without an id are given one, rows that fail validation are skipped and listed in an error file.')
+        import_file = st.file_uploader('Import file', type=['csv', 'xlsx'], key=f'{inventory_type}_import_file')
+        if import_file and st.button('Import Items', key=f'{inventory_type}_import'):
+            progress_bar = st.progress(0.0)
+            size = max(import_file.size, 1)
+
+            def show_progress(rows_read, imported):
+                progress_bar.progress(min(import_file.tell() / size, 1.0), text=f'{rows_read} rows read, {imported} imported')
+
+            try:
+                imported, errors = sci_import.import_file(db, inventory_type, import_file, import_file.name,
+                                                          progress=show_progress)
+            except ImportError as e:
+                st.error(str(e))
+            except sci_import.ImportFileError as e:
+                st.error(str(e))
+                if e.imported:
+                    st.warning(f'{e.imported} items from before the error were imported to {inventory_type}.')
+            else:
+                progress_bar.progress(1.0, text=f'{imported} imported')
+                st.success(f'Successfully imported {imported} items to {inventory_type}.')
+                if len(errors):
+                    st.warning(f'{len(errors)} rows were skipped.')
+                    st.download_button('Download Error File', errors.to_csv(index=False),
+                                       file_name=f'{inventory_type}_import_errors.csv', mime='text/csv')
+
+    with tab_locations:
+        manage_locations(db, inventory_type, df, ids)
+
+
+def show_update_result(inventory_type, update_id, updated):
+    if updated is None:
+        st.error(f'{update_id} was not found in {inventory_type}.')
+    else:
+        st.success(f'Successfully updated {update_id} in {inventory_type}.')
+
+
+def record_custody(inventory_type, item_id, before, after, updated):
+    """Log owner and location edits of samples to the chain of custody"""
+    if inventory_type == 'inventory_samples' and updated:
+        sci_custody.record_changes(sci_setup.custody_log(st.secrets.get('custody_dir', 'custody')),
+                                   item_id, before, after, by=sci_setup.current_user())
+
+
+def manage_locations(db, inventory_type, df, ids):
+    st.caption('Storage locations nest as building, room, freezer, rack and box. '
+               'Set an item\'s location to the ID of the location holding it, and its position in a box, e.g. A1. '
+               'Locations entered as text before storage locations were set up, e.g. Lab 1, are kept as they are until assigned below.')
+    tree = sci_locations.location_tree(db)
+    index = sci_locations.location_index(db, inventory_type)
+    location_ids = tree.ordered()
+
+    location_id = st.selectbox('Location', location_ids, format_func=tree.label, key=f'{inventory_type}_location')
+    if location_id:
+        # Everything below the location, found through its range of the sorted paths
+        item_ids = sci_locations.subtree_items(tree, index, location_id)
+        st.caption(f'{len(item_ids)} items in {tree.label(location_id)} ({location_id})')
+        positions = [ids.position(item_id) for item_id in item_ids]
+        st.dataframe(df.iloc[[position for position in positions if position is not None]], use_container_width=True)
+
+        if tree.level(location_id) == 'box':
+            names = {item_id: df['name'].iat[ids.position(item_id)] for item_id in sci_locations.occupancy(tree, index, location_id).values()
+                     if ids.position(item_id) is not None}
+            st.dataframe(sci_locations.occupancy_grid(tree, index, location_id, names), use_container_width=True)
+
+        free = sci_locations.free_slot(tree, index, location_id)
+        if free:
+            st.info(f'Next free slot: location {free[0]} ({tree.label(free[0])}), position {free[1]}')
+        elif tree.boxes(location_id):
+            st.warning(f'Every box in {tree.label(location_id)} is full.')
+
+    with st.expander('Add Location'):
+        parent_id = st.selectbox('Inside', [''] + location_ids, format_func=lambda x: tree.label(x) if x else '-', key=f'{inventory_type}_location_parent')
+        level = st.selectbox('Level', sci_locations.LEVELS, key=f'{inventory_type}_location_level')
+        name = st.text_input('Name', key=f'{inventory_type}_location_name')
+        if level == 'box':
+            col_rows, col_cols = st.columns(2)
+            rows = col_rows.number_input('Rows', min_value=1, max_value=26, value=9, key=f'{inventory_type}_location_rows')
+            cols = col_cols.number_input('Columns', min_value=1, max_value=26, value=9, key=f'{inventory_type}_location_cols')
+        else:
+            rows, cols = 0, 0
+        if st.button('Add Location', key=f'{inventory_type}_location_add', disabled=not name):
+            try:
+                new_id = sci_locations.add_location(db, tree, name, level, parent_id, rows, cols)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f'Successfully added {name} as {new_id}.')
+
+    legacy = sci_locations.legacy_locations(tree, db.list(inventory_type))
+    if legacy:
+        with st.expander(f'Free Text Locations ({len(legacy)})'):
+            st.caption('Assign a location entered as text to a storage location, every item with that text moves into it')
+            text = st.selectbox('Text', legacy, format_func=lambda x: f'{x} ({legacy[x]} items)', key=f'{inventory_type}_location_legacy')
+            assign_id = st.selectbox('Storage location', location_ids, format_func=tree.label, key=f'{inventory_type}_location_legacy_to')
+            if st.button('Assign Location', key=f'{inventory_type}_location_legacy_button', disabled=not assign_id):
+                moved = sci_locations.assign_location(db, inventory_type, text, assign_id)
+                for before, after in moved:
+                    record_custody(inventory_type, before['id'], before, after, True)
+                st.success(f'Moved {len(moved)} of {legacy[text]} items from {text} to {tree.label(assign_id)}.')
+
+    with st.expander('Move Location'):
+        st.caption('Everything inside moves with it, the items themselves are not changed')
+        move_id = st.selectbox('Location', location_ids, format_func=tree.label, key=f'{inventory_type}_location_move')
+        new_parent_id = st.selectbox('Move into', [''] + location_ids, format_func=lambda x: tree.label(x) if x else '-', key=f'{inventory_type}_location_move_to')
+        if move_id and st.button('Move Location', key=f'{inventory_type}_location_move_button'):
+            try:
+                sci_locations.move_location(db, tree, move_id, new_parent_id)
+            except (ValueError, sci_sheets.ConflictError) as e:
+                st.error(str(e))
+            else:
+                st.success(f'Successfully moved {tree.label(move_id)} into {tree.label(new_parent_id) if new_parent_id else "the top level"}.')
+
+
+def build_search_index(records, inventory_type):
+    df = sci_schema.to_frame(records, inventory_type)
+    return df, sci_search.SearchIndex(df)
+
 
 equipment_calssification = [
     {"application": "Analytical", "type": "Chromatography", "sub_type": "High Performance Liquid Chromatography (HPLC)"},
@@ -168,89 +318,6 @@ equipment_calssification_dict = defaultdict(dict)
 for item in equipment_calssification:
     equipment_calssification_dict[item['application']][item['type']] = item['sub_type']
 
-# database_structures = {
-#     "inventory_equipment": ['id', 'name', 'type', 'sub_type', 'manufacturer', 'model', 'serial_number', 'location', 'notes'],
-#     "inventory_reagents": ['id', 'name', 'supplier', 'catalog_number', 'lot_number', 'expiration_date', 'cas', 'location', 'notes'],
-#     "inventory_samples": ['id', 'name', 'type', 'description', 'owner', 'location', 'notes'],
-#     "inventory_supplies": ['id', 'name', 'description', 'supplier', 'catalog_number', 'location', 'notes'],
-#     "sops": ['id', 'category', 'number', 'version', 'title', 'effective_date', 'purpose', 'related_documents', 'scope', 'procedure', 'references'],
-#     }
-
-database_structures = {
-    "inventory_equipment": [
-        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the equipment", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "EQ-99414a"},
-        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "HPLC - Agilent 1260 Infinity II"},
-        {"column_name": "application", "formated_name": "Application", "type": "string", "description": "Application of the equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Analytical"},
-        {"column_name": "type", "formated_name": "Type", "type": "string", "description": "Type of equipment", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Chromatography"},
-        {"column_name": "sub_type", "formated_name": "Sub Type", "type": "string", "description": "Sub type of equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "High Performance Liquid Chromatography (HPLC)"},
-        {"column_name": "manufacturer", "formated_name": "Manufacturer", "type": "string", "description": "Manufacturer of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Agilent"},
-        {"column_name": "model", "formated_name": "Model", "type": "string", "description": "Model of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "1260 Infinity II"},
-        {"column_name": "serial_number", "formated_name": "Serial Number", "type": "string", "description": "Serial number of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "US12345678"},
-        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "Location of the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Lab 1"},
-        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the equipment", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Used for HPLC analysis"},       
-    ],
-    "inventory_reagents": [
-        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the reagent", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "RRE-02c045"},
-        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Acetonitrile"},
-        {"column_name": "supplier", "formated_name": "Supplier", "type": "string", "description": "Supplier of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Fisher Scientific"},
-        {"column_name": "catalog_number", "formated_name": "Catalog Number", "type": "string", "description": "Catalog number of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "A998-4"},
-        {"column_name": "lot_number", "formated_name": "Lot Number", "type": "string", "description": "Lot number of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "123456"},
-        {"column_name": "expiration_date", "formated_name": "Expiration Date", "type": "date", "description": "Expiration date of the reagent", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "2021-12-31"},
-        {"column_name": "cas", "formated_name": "CAS", "type": "string", "description": "Chemical Abstracts Service (CAS) number of the reagent", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "75-05-8"},
-        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "Location of the reagent", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Lab 1"},
-        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the reagent", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in flammable cabinet"},
-    ],
-    "inventory_samples": [
-        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the sample", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "SA-ad6b54"},
-        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the sample", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Sample 1"},
-        {"column_name": "type", "formated_name": "Type", "type": "string", "description": "Type of sample", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Chemical"},
-        {"column_name": "description", "formated_name": "Description", "type": "string", "description": "Description of the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Sample of chemical X"},
-        {"column_name": "owner", "formated_name": "Owner", "type": "string", "description": "Owner of the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "John Smith"},
-        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "Location of the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Lab 1"},
-        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the sample", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in freezer"},
-    ],
-    "inventory_supplies": [
-        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the supply", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "SU-30acb7"},
-        {"column_name": "name", "formated_name": "Name", "type": "string", "description": "Name of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Gloves, Nitrile, M"},
-        {"column_name": "category", "formated_name": "Category", "type": "string", "description": "Category of the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "PPE"},
-        {"column_name": "description", "formated_name": "Description", "type": "string", "description": "Description of the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Nitrile gloves, size medium"},
-        {"column_name": "supplier", "formated_name": "Supplier", "type": "string", "description": "Supplier of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Fisher Scientific"},
-        {"column_name": "catalog_number", "formated_name": "Catalog Number", "type": "string", "description": "Catalog number of the supply", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "11889610"},
-        {"column_name": "location", "formated_name": "Location", "type": "string", "description": "Location of the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Lab 1"},
-        {"column_name": "notes", "formated_name": "Notes", "type": "string", "description": "Notes about the supply", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Stored in cabinet"},
-    ],
-    "sops": [
-        {"column_name": "id", "formated_name": "ID", "type": "string", "description": "Unique identifier for the SOP", "required": True, "unique": True, "primary_key": True, "foreign_key": False, "default": None, "example": "QA-0001-v01"},
-        {"column_name": "category", "formated_name": "Category", "type": "string", "description": "Category of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Quality Assurance"},
-        {"column_name": "number", "formated_name": "Number", "type": "int", "description": "Number of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 1},
-        {"column_name": "version", "formated_name": "Version", "type": "int", "description": "Version of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": 1},
-        {"column_name": "title", "formated_name": "Title", "type": "string", "description": "Title of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "Document Control Procedure"},
-        {"column_name": "effective_date", "formated_name": "Effective Date", "type": "date", "description": "Effective date of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "2021-01-01"},
-        {"column_name": "purpose", "formated_name": "Purpose", "type": "string", "description": "Purpose of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "To ensure that all documents are controlled and that only current versions are available for use."},
-        {"column_name": "scope", "formated_name": "Scope", "type": "string", "description": "Scope of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None,
-            "example": "This procedure applies to all documents that form part of the laboratorys Quality Management System (QMS), including SOPs, work instructions, forms, protocols, and reports."},
-        {"column_name": "responsibilities", "formated_name": "Responsibilities", "type": "string", "description": "Responsibilities of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": """
-            1. Document Controller: Responsible for maintaining and updating the Document Control Register, and for distributing controlled documents.
-            2. Department Heads: Responsible for ensuring documents within their area are kept current and staff are trained on the latest revisions.
-            3. All Employees: Responsible for following the most current version of each document.
-            """},
-        {"column_name": "procedure", "formated_name": "Procedure", "type": "string", "description": "Procedure of the SOP", "required": True, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": """
-            ## 1. Document Creation
-            Documents should be written in clear, concise language, and follow the laboratorys standard format. Once drafted, documents should be reviewed and approved by the document owner and department head.
-            ## 2. Document Review and Approval
-            All new or revised documents must be reviewed for adequacy by the department head and approved by the Quality Assurance department. The review and approval must be documented.
-            ## 3. Document Distribution
-            Upon approval, the Document Controller should distribute the document to all relevant parties, and ensure obsolete versions are withdrawn. The distribution and receipt of controlled documents should be recorded.
-            ## 4. Document Revision
-            Any changes to a document must go through the same review and approval process as a new document. Each revision should be given a new version number, and the changes should be summarized in a revision history table in the document.
-            ## 5. Document Archiving
-            Superseded versions of documents should be archived for a defined period according to the laboratorys record retention policy.
-            ## 6. Document Training
-            All affected personnel should be trained on new or revised documents prior to implementation. Training should be documented.
-            """},
-        {"column_name": "references", "formated_name": "References", "type": "string", "description": "References of the SOP", "required": False, "unique": False, "primary_key": False, "foreign_key": False, "default": None, "example": "ISO 17025:2017"},
-    ],
-}
-
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
+    sci_trace.finish_rerun()
@@ -0,0 +1,98 @@
+import streamlit as st
+import pandas as pd
+from datetime import datetime
+
+from helpers import sci_custody, sci_locations, sci_setup, sci_sheets, sci_trace
+
+sci_setup.setup_page('Chain of Custody')
+sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets['gcp_service_account'])
+sci_setup.connect_storage(st.secrets.get('storage'))
+
+EVENT_LABELS = {
+    'check_out': 'Check out',
+    'check_in': 'Check in',
+    'transfer': 'Transfer',
+    'location_change': 'Location change',
+}
+
+
+def main():
+    st.caption("""
+    Chain of custody is the record of who held each sample, and where it was, from receipt to disposal.
+    Every check out, check in, transfer and location change is kept, the sample inventory only shows the latest owner and location.
+    Times are in UTC.
+    """)
+
+    log = sci_setup.custody_log(st.secrets.get('custody_dir', 'custody'))
+    db = st.session_state['db']
+    tree = sci_locations.location_tree(db)
+
+    tab_history, tab_location, tab_record = st.tabs(['Sample History', 'Location at Time', 'Record Event'])
+
+    with tab_history:
+        sample_id = st.text_input('Sample ID', key='custody_history_id')
+        if sample_id:
+            events = log.history(sample_id)
+            if events:
+                st.dataframe(events_frame(events, tree), use_container_width=True)
+            else:
+                st.info(f'No custody events for {sample_id}.')
+
+    with tab_location:
+        location_id = st.selectbox('Location', [''] + tree.ordered(), format_func=lambda x: tree.label(x) if x else 'Other, entered as text',
+                                   key='custody_location_id')
+        if location_id:
+            # A location takes in everything inside it, e.g. the racks and boxes of a freezer
+            locations, location = tree.subtree(location_id), tree.label(location_id)
+        else:
+            location = st.text_input('Location', key='custody_location', help='Recorded as text before storage locations were set up, e.g. Lab 1')
+            locations = [location]
+        col_date, col_time = st.columns(2)
+        at_date = col_date.date_input('Date', key='custody_at_date')
+        at_time = col_time.time_input('Time', key='custody_at_time')
+        if location:
+            at = datetime.combine(at_date, at_time)
+            events = log.at_location(locations, at)
+            st.caption(f'{len(events)} samples at {location} on {at:%Y-%m-%d %H:%M}')
+            if events:
+                st.dataframe(events_frame(events, tree), use_container_width=True)
+
+    with tab_record:
+        record_id = st.text_input('Sample ID', key='custody_record_id')
+        sample = db.get('inventory_samples', record_id) if record_id else None
+        if record_id and sample is None:
+            st.warning(f'{record_id} is not in inventory_samples.')
+        if sample is not None:
+            current = log.current(record_id) or {}
+            event = st.selectbox('Event', sci_custody.EVENT_TYPES, format_func=EVENT_LABELS.get, key='custody_event')
+            owner = st.text_input('Owner', value=current.get('owner') or str(sample.get('owner', '')), key='custody_owner')
+            current_location = str(current.get('location') or sample.get('location') or '')
+            # A location still held as text stays selectable until the sample is moved into a storage location
+            options = tree.ordered() if current_location in tree else [current_location] + tree.ordered()
+            location = st.selectbox('Location', options, index=options.index(current_location),
+                                    format_func=lambda x: sci_locations.describe(tree, x), key='custody_record_location')
+            notes = st.text_area('Notes', key='custody_notes')
+            if st.button('Record Event', key='custody_record'):
+                try:
+                    # Keep the inventory's current owner and location in step with the log
+                    updated = db.update('inventory_samples', record_id, {'owner': owner, 'location': location}, before=sample)
+                except sci_sheets.ConflictError as e:
+                    st.error(f'{e}. Check the sample and record the event again.')
+                else:
+                    if updated is None:
+                        st.error(f'{record_id} is no longer in inventory_samples, no event was recorded.')
+                    else:
+                        recorded = log.append(record_id, event, location=location, owner=owner, by=sci_setup.current_user(), notes=notes)
+                        st.success(f'Recorded {EVENT_LABELS[event].lower()} of {record_id} at {recorded["time"]}.')
+
+
+def events_frame(events, tree):
+    df = pd.DataFrame(events, columns=['time', 'sample_id', 'event', 'owner', 'location', 'by', 'notes'])
+    df['event'] = df['event'].map(EVENT_LABELS)
+    df['location'] = [sci_locations.describe(tree, location) for location in df['location']]
+    return df
+
+
+if __name__ == '__main__':
+    main()
+    sci_trace.finish_rerun()
@@ -0,0 +1,66 @@
+import streamlit as st
+import pandas as pd
+from datetime import datetime, time, timedelta
+
+from helpers import sci_schema, sci_setup, sci_trace
+
+sci_setup.setup_page('Security and Audit Trails')
+sci_setup.connect_google_sheets('SciSpaceLIMS', st.secrets['gcp_service_account'])
+sci_setup.connect_storage(st.secrets.get('storage'))
+
+
+def main():
+    st.caption("""
+    The audit trail records every change made to the inventory and SOP databases: who made it, what was added, changed or removed, the record before and after, and when.
+    With the replica backend, a change overwritten by a newer edit made directly in the spreadsheet is followed by a revert entry from the sync user.
+    Each entry includes a hash of the entry before it, so any later edit, removal or reordering of entries is detected on verification.
+    Times are in UTC.
+    """)
+
+    log = st.session_state['db'].log
+
+    col_start, col_end = st.columns(2)
+    start_date = col_start.date_input('From', value=datetime.utcnow().date() - timedelta(days=30), key='audit_start')
+    end_date = col_end.date_input('To', value=datetime.utcnow().date(), key='audit_end')
+    start, end = datetime.combine(start_date, time.min), datetime.combine(end_date, time.max)
+
+    tab_log, tab_verify = st.tabs(['Audit Log', 'Verify'])
+
+    with tab_log:
+        col_table, col_id = st.columns(2)
+        table = col_table.selectbox('Table', ['All'] + list(sci_schema.database_structures), key='audit_table')
+        item_id = col_id.text_input('Record ID', key='audit_item_id')
+        entries = log.entries(start, end, table=None if table == 'All' else table, item_id=item_id or None)
+        st.caption(f'{len(entries)} entries')
+        if entries:
+            st.dataframe(entries_frame(entries), use_container_width=True)
+
+    with tab_verify:
+        head = log.head()
+        st.caption(f'Latest entry {head["seq"]} at {head["time"] or "-"}, hash `{head["hash"]}`  \n'
+                   'Keep a copy of this hash with inspection records, a log rewritten after today will no longer end in it')
+        if st.button('Verify', key='audit_verify'):
+            with st.spinner('Verifying hash chain'):
+                result = log.verify(start, end)
+            if result['ok']:
+                st.success(f'Entries {result["first_seq"]} to {result["last_seq"]} are intact ({result["checked"]} checked)')
+            else:
+                st.error(f'{result["error"]}. Entries {result["first_seq"]} to {result["last_seq"]} are intact.')
+
+
+def entries_frame(entries):
+    df = pd.DataFrame(entries, columns=['seq', 'time', 'user', 'action', 'table', 'id', 'before', 'after', 'hash'])
+    # Only the columns a write changed are shown
+    df['changes'] = [changes(entry['before'], entry['after']) for entry in entries]
+    return df[['seq', 'time', 'user', 'action', 'table', 'id', 'changes', 'hash']]
+
+
+def changes(before, after):
+    before, after = before or {}, after or {}
+    return ', '.join(f'{col}: {before.get(col, "")} → {after.get(col, "")}'
+                     for col in dict.fromkeys([*before, *after]) if str(before.get(col, '')) != str(after.get(col, '')))
+
+
+if __name__ == '__main__':
+    main()
+    sci_trace.finish_rerun()
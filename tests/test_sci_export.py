@@ -0,0 +1,38 @@
+import zipfile
+from io import BytesIO
+
+import fitz
+import pytest
+
+from benchmarks.bench_sop_render import synthetic_sop
+from helpers import sci_export
+
+
+def export(records, merged):
+    buffer = BytesIO()
+    errors = sci_export.export_sops(records, buffer, merged, max_workers=2)
+    return errors, zipfile.ZipFile(buffer)
+
+
+@pytest.mark.parametrize('merged', [False, True])
+def test_no_sops(merged):
+    errors, zf = export([], merged)
+    assert errors == {}
+    assert zf.namelist() == []
+
+
+@pytest.mark.parametrize('merged', [False, True])
+def test_every_sop_fails(merged):
+    records = [{**synthetic_sop(10), 'id': f'QU-000{i}-v01', 'procedure': 'not json'} for i in range(2)]
+    errors, zf = export(records, merged)
+    assert sorted(errors) == ['QU-0000-v01', 'QU-0001-v01']
+    assert zf.namelist() == ['errors.txt']
+
+
+def test_merged_keeps_the_sops_that_rendered():
+    records = [synthetic_sop(10), {**synthetic_sop(10), 'id': 'QU-0002-v01', 'procedure': 'not json'}]
+    errors, zf = export(records, True)
+    assert list(errors) == ['QU-0002-v01']
+    assert sorted(zf.namelist()) == ['SOPs.pdf', 'errors.txt']
+    with fitz.open(stream=zf.read('SOPs.pdf'), filetype='pdf') as pdf:
+        assert [entry[1] for entry in pdf.get_toc()] == ['QU-0001-v01 - Document Control Procedure']
@@ -0,0 +1,47 @@
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook
+
+from helpers import sci_import, sci_storage
+
+TABLE = 'inventory_samples'
+
+
+def import_bytes(data, file_name, chunk_size=sci_import.CHUNK_SIZE):
+    db = sci_storage.SQLiteStorage(':memory:')
+    return db, sci_import.import_file(db, TABLE, BytesIO(data), file_name, chunk_size)
+
+
+def xlsx(rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_imports_valid_rows():
+    db, (imported, errors) = import_bytes(b'name,type\nS1,Chem\nS2,Bio\n', 'samples.csv')
+    assert imported == 2 and len(errors) == 0
+    assert sorted(record['name'] for record in db.list(TABLE)) == ['S1', 'S2']
+
+
+@pytest.mark.parametrize('data, file_name', [
+    (b'name,type\nS1,Chem\nS2,Bio,extra,cells\n', 'samples.csv'),
+    (b'name,type\n\xff\xfe\x00S1,Chem\n', 'samples.csv'),
+    (b'', 'samples.csv'),
+    (b'not a zip file', 'samples.xlsx'),
+    (xlsx([['name', 'name'], ['S1', 'S2']]), 'samples.xlsx'),
+])
+def test_unreadable_file_raises_import_file_error(data, file_name):
+    with pytest.raises(sci_import.ImportFileError):
+        import_bytes(data, file_name)
+
+
+def test_chunks_before_a_malformed_row_stay_imported():
+    data = b'name,type\nS1,Chem\nS2,Bio\nS3,"Bio\nS4,Bio\n'
+    with pytest.raises(sci_import.ImportFileError) as e:
+        import_bytes(data, 'samples.csv', chunk_size=2)
+    assert e.value.imported == 2
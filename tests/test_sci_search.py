@@ -0,0 +1,24 @@
+from helpers import sci_schema, sci_search
+
+RECORDS = [
+    {'id': 'RE-1', 'name': 'Acetonitrile', 'supplier': 'Fisher', 'expiration_date': '2021-12-31', 'location': 'Freezer 2', 'notes': ''},
+    {'id': 'RE-2', 'name': 'Methanol', 'supplier': '', 'expiration_date': '', 'location': '', 'notes': ''},
+]
+
+
+def search_ids(query):
+    df = sci_schema.to_frame(RECORDS, 'inventory_reagents')
+    return list(sci_search.SearchIndex(df).search(df, query)['id'])
+
+
+def test_empty_typed_cells_do_not_match():
+    assert search_ids('nan') == []
+    assert search_ids('location:nan') == []
+    assert search_ids('nat') == []
+    assert search_ids('<na>') == []
+
+
+def test_values_still_match():
+    assert search_ids('location:freezer') == ['RE-1']
+    assert search_ids('methanol') == ['RE-2']
+    assert search_ids('2021-12-31') == ['RE-1']
@@ -0,0 +1,36 @@
+import pytest
+
+from benchmarks.fake_gspread import FakeSpreadsheet
+from helpers import sci_sheets, sci_storage
+
+OLD_SAMPLES_HEADER = ['id', 'name', 'type', 'description', 'owner', 'location', 'notes']
+
+
+@pytest.fixture(autouse=True)
+def no_write_spacing(monkeypatch):
+    monkeypatch.setattr(sci_sheets, 'MIN_WRITE_INTERVAL', 0)
+
+
+def test_reads_leave_the_header_alone():
+    sh = FakeSpreadsheet({'inventory_samples': [OLD_SAMPLES_HEADER, ['SA-1', 'S1', '', '', '', 'Lab 1', '']],
+                          'sops': [['id', 'title', 'scope_covered'], ['QU-0001-v01', 'Doc control', '[]']]})
+    db = sci_storage.SheetsStorage(sh)
+    db.list('inventory_samples')
+    db.list('sops')
+    db.columns('inventory_samples')
+    assert sh.data['inventory_samples'][0] == OLD_SAMPLES_HEADER
+    assert sh.data['sops'][0] == ['id', 'title', 'scope_covered']
+
+
+def test_write_adds_only_the_columns_it_has_values_for():
+    sh = FakeSpreadsheet({'inventory_samples': [OLD_SAMPLES_HEADER]})
+    db = sci_storage.SheetsStorage(sh)
+    db.insert('inventory_samples', {'id': 'SA-1', 'name': 'S1', 'location': 'LO-1', 'position': None})
+    assert sh.data['inventory_samples'][0] == OLD_SAMPLES_HEADER
+
+    db.insert('inventory_samples', {'id': 'SA-2', 'name': 'S2', 'location': 'LO-1', 'position': 'A1'})
+    assert sh.data['inventory_samples'][0] == OLD_SAMPLES_HEADER + ['position']
+    assert db.get('inventory_samples', 'SA-2')['position'] == 'A1'
+
+    db.update('inventory_samples', 'SA-1', {'position': 'B2'})
+    assert db.get('inventory_samples', 'SA-1')['position'] == 'B2'
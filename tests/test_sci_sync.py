@@ -0,0 +1,72 @@
+from benchmarks.fake_gspread import FakeSpreadsheet
+from helpers import sci_storage, sci_sync
+
+TABLE = 'inventory_samples'
+HEADER = ['id', 'name', 'type', 'description', 'owner', 'location', 'position', 'notes']
+
+
+def make_sync(tmp_path, rows):
+    sh = FakeSpreadsheet({TABLE: [HEADER] + rows})
+    sync = sci_sync.SheetsSync(sh, sci_storage.SQLiteStorage(str(tmp_path / 'replica.db')), [TABLE])
+    sync.pull(force=True)
+    return sh, sync, sci_sync.ReplicaStorage(sync)
+
+
+def remote_edit(sh, item_id, col, value):
+    row = next(row for row in sh.data[TABLE] if row[0] == item_id)
+    row[HEADER.index(col)] = value
+    sh.touch()
+
+
+def test_lost_update_is_replaced_by_remote_row(tmp_path):
+    sh, sync, db = make_sync(tmp_path, [['SA-1', 'alice', '', '', '', '', '', '']])
+    db.update(TABLE, 'SA-1', {'name': 'carol'})
+    remote_edit(sh, 'SA-1', 'name', 'bob')
+    # Pulled while the local update is still queued
+    sync.pull()
+    assert db.get(TABLE, 'SA-1')['name'] == 'carol'
+
+    sync.push()
+    assert [(conflict['id'], conflict['columns']) for conflict in sync.conflicts] == [('SA-1', ['name'])]
+    assert sh.data[TABLE][1][1] == 'bob'
+    assert db.get(TABLE, 'SA-1')['name'] == 'bob'
+
+    sync.resolve(sync.conflicts[0], keep_local=False)
+    sync.pull(force=True)
+    assert db.get(TABLE, 'SA-1')['name'] == 'bob'
+
+
+def test_lost_delete_is_reinserted(tmp_path):
+    sh, sync, db = make_sync(tmp_path, [['SA-1', 'alice', '', '', '', '', '', '']])
+    db.delete(TABLE, 'SA-1')
+    remote_edit(sh, 'SA-1', 'notes', 'kept')
+    sync.pull()
+    assert db.get(TABLE, 'SA-1') is None
+
+    sync.push()
+    assert [conflict['op'] for conflict in sync.conflicts] == ['delete']
+    assert db.get(TABLE, 'SA-1')['notes'] == 'kept'
+
+
+def test_pushed_update_merges_cells(tmp_path):
+    sh, sync, db = make_sync(tmp_path, [['SA-1', 'alice', 'cell', '', '', '', '', '']])
+    db.update(TABLE, 'SA-1', {'name': 'carol'})
+    remote_edit(sh, 'SA-1', 'type', 'tissue')
+    sync.pull()
+    sync.push()
+    assert sync.conflicts == []
+    assert sh.data[TABLE][1][:3] == ['SA-1', 'carol', 'tissue']
+    assert db.get(TABLE, 'SA-1')['type'] == 'tissue'
+
+
+def test_push_adds_a_missing_column_it_writes(tmp_path):
+    old_header = [col for col in HEADER if col != 'position']
+    sh = FakeSpreadsheet({TABLE: [old_header, ['SA-1', 'alice', '', '', '', '', '']]})
+    sync = sci_sync.SheetsSync(sh, sci_storage.SQLiteStorage(str(tmp_path / 'replica.db')), [TABLE])
+    sync.pull(force=True)
+    assert sh.data[TABLE][0] == old_header
+
+    sci_sync.ReplicaStorage(sync).update(TABLE, 'SA-1', {'location': 'LO-1', 'position': 'A1'})
+    sync.push()
+    assert sh.data[TABLE][0] == old_header + ['position']
+    assert sh.data[TABLE][1][-1] == 'A1'